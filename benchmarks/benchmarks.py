@@ -0,0 +1,256 @@
+#Benchmarks of the map and track pipeline, run with asv (see README)
+import glob
+import os
+import shutil
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen') #tracks need a window, but not a screen
+
+import cooler
+import numpy as np
+import pandas as pd
+
+from prohic import prohic
+from prohic.prohic import hicInterface, MatrixCache, OE, LOG, NORM, expected, makeLUT, quantize, levelIndex
+from prohic.colormaps import colormaps
+
+testdata=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata')
+
+np.seterr(invalid='ignore', divide='ignore')
+
+
+def testMaps(): #"organism/file.mcool@resolution" of every testdata level
+	out=[]
+	for file in sorted(glob.glob(os.path.join(testdata, '*', '*.mcool'))):
+		for uri in cooler.fileops.list_coolers(file):
+			out.append(os.path.relpath(file, testdata)+'@'+uri.split('/')[-1])
+	return out
+
+
+def openMap(param, oe=False, log=True, stats='warm'): #stats='cold' computes them ignoring the ones kept on disk
+	file,res=param.split('@')
+	hic=hicInterface()
+	hic.oe,hic.log=oe,log
+	if stats=='cold':
+		hic.expectedCache,hic.statsCache,hic.histCache,hic.resolutionCache={},{},{},{}
+	hic.open(os.path.join(testdata, file), int(res))
+	return hic
+
+
+def circularMap(n): #Dense synthetic map of a circular genome: decay with circular distance, noise and a few empty bins
+	rng=np.random.default_rng(n)
+	d=np.arange(n)
+	d=np.minimum(d, n-d)
+	data=prohic.circulant(1000/(1+d)**1.2).copy()
+	data*=rng.lognormal(0, 0.3, (n, n))
+	data=(data+data.T)/2
+	empty=rng.choice(n, n//100, replace=False)
+	data[empty]=np.nan
+	data[:, empty]=np.nan
+	return data
+
+
+def circularCooler(path, n, res=1000, band=1000): #Synthetic .cool of a circular genome, contacts up to band bins apart
+	rng=np.random.default_rng(n)
+	band=min(band, n//2)
+	rows,cols=[],[]
+	for dist in range(band+1):
+		i=np.arange(n-dist)
+		rows.append(i)
+		cols.append(i+dist)
+		if 0<dist<n-dist: #contacts across the origin
+			i=np.arange(dist)
+			rows.append(i)
+			cols.append(i+n-dist)
+	rows,cols=np.concatenate(rows),np.concatenate(cols)
+	dist=np.minimum(cols-rows, n-cols+rows)
+	counts=rng.poisson(1000/(1+dist)**1.2)+1
+	bins=pd.DataFrame({'chrom':'chr', 'start':np.arange(n)*res, 'end':np.arange(1, n+1)*res, 'weight':1.0})
+	pixels=pd.DataFrame({'bin1_id':rows, 'bin2_id':cols, 'count':counts}).sort_values(['bin1_id', 'bin2_id'])
+	cooler.create_cooler(path, bins, pixels, ordered=True)
+
+
+class TestdataOpen:
+	params=[testMaps(), ['cold', 'warm']]
+	param_names=['map', 'stats']
+	timeout=300
+
+	def setup(self, param, stats):
+		openMap(param) #statistics are stored
+
+	def time_open(self, param, stats):
+		openMap(param, stats=stats)
+
+	def peakmem_open(self, param, stats):
+		openMap(param, stats=stats)
+
+
+class TestdataProcess:
+	params=[testMaps(), [False, True], [False, True]]
+	param_names=['map', 'oe', 'log']
+	timeout=300
+
+	def setup(self, param, oe, log):
+		self.hic=openMap(param)
+		self.hic.oe,self.hic.log=oe,log
+		self.hic.cache=MatrixCache(0) #every call processes from scratch
+
+	def time_process(self, param, oe, log):
+		self.hic.expectedCache,self.hic.statsCache,self.hic.histCache={},{},{}
+		self.hic.process()
+
+	def peakmem_process(self, param, oe, log):
+		self.hic.expectedCache,self.hic.statsCache,self.hic.histCache={},{},{}
+		self.hic.process()
+
+
+class TestdataProduct:
+	params=[testMaps(), [0, 25, 50]]
+	param_names=['map', 'shift']
+
+	def setup(self, param, shift):
+		self.hic=openMap(param)
+		self.hic.shift=shift
+
+	def time_product(self, param, shift):
+		self.hic.product()
+
+	def peakmem_product(self, param, shift):
+		self.hic.product()
+
+
+class DenseFunctions:
+	params=[[1000, 2000, 4000, 8000]]
+	param_names=['bins']
+	timeout=300
+
+	def setup(self, n):
+		self.data=circularMap(n)
+		self.exp=expected(self.data)
+
+	def time_expected(self, n):
+		expected(self.data)
+
+	def time_OE(self, n):
+		OE(self.data, exp=self.exp)
+
+	def peakmem_OE(self, n):
+		OE(self.data, exp=self.exp)
+
+	def time_LOG(self, n):
+		LOG(self.data)
+
+	def peakmem_LOG(self, n):
+		LOG(self.data)
+
+	def time_NORM(self, n):
+		NORM(self.data)
+
+	def peakmem_NORM(self, n):
+		NORM(self.data)
+
+	def time_quantize(self, n):
+		quantize(self.data)
+
+
+class SyntheticMaps: #bigger than lazyBins are kept as sparse nonzero cells, or read by tiles if these do not fit
+	params=[[1000, 2000, 5000, 10000, 20000], [False, True], ['sparse', 'tiles']]
+	param_names=['bins', 'oe', 'storage']
+	timeout=600
+
+	def setup_cache(self):
+		for n in self.params[0]:
+			circularCooler('synthetic_{}.cool'.format(n), n)
+
+	def setup(self, n, oe, storage):
+		if n<=hicInterface().lazyBins and storage=='tiles': #dense maps either way
+			raise NotImplementedError
+		self.file=os.path.abspath('synthetic_{}.cool'.format(n))
+		self.hic=self.open(oe, storage)
+
+	def open(self, oe, storage):
+		hic=hicInterface()
+		hic.oe=oe
+		if storage=='tiles':
+			hic.cacheBudget=0
+		hic.open(self.file)
+		return hic
+
+	def time_open(self, n, oe, storage):
+		self.open(oe, storage)
+
+	def peakmem_open(self, n, oe, storage):
+		self.open(oe, storage)
+
+	def time_view(self, n, oe, storage): #1024 bins square around the middle of the diagonal, as drawn at 1 bin per pixel
+		if self.hic.lazy():
+			if self.hic.tiles is not None:
+				self.hic.tiles.tiles.clear()
+			self.hic.block(n//2-512, n//2+512, n//2-512, n//2+512)
+		else:
+			self.hic.product()
+
+
+class SyntheticOverview: #whole big map at about 1000 pixels, from sparse cells only: tiles of all the map would be read
+	params=[[10000, 20000], [False, True]]
+	param_names=['bins', 'oe']
+	timeout=600
+
+	def setup_cache(self):
+		for n in self.params[0]:
+			circularCooler('synthetic_{}.cool'.format(n), n)
+
+	def setup(self, n, oe):
+		self.hic=hicInterface()
+		self.hic.oe=oe
+		self.hic.open(os.path.abspath('synthetic_{}.cool'.format(n)))
+
+	def time_overview(self, n, oe):
+		self.hic.block(0, n, 0, n, max(1, n//1000))
+
+
+class LUT: #both are cached, the uncached functions are timed
+
+	def time_makeLUT(self):
+		for name in colormaps:
+			makeLUT.__wrapped__(name)
+
+	def peakmem_makeLUT(self):
+		for name in colormaps:
+			makeLUT.__wrapped__(name)
+
+	def time_levelIndex(self):
+		levelIndex.__wrapped__((0.25, 0.75))
+
+
+class Tracks:
+	params=[['Caulobacter/Caulobacter_ori-ter.bed', 'Caulobacter/Caulobacter_tRNA.gff3', 'Haloferax/Haloferax_RNA-seq.bedgraph'],
+		['cold', 'warm']]
+	param_names=['track', 'sidecar']
+	number=1 #every call adds a track to the window
+	repeat=10
+
+	def setup_cache(self): #tracks are copied, sidecar files are not written to testdata
+		for track in self.params[0]:
+			os.makedirs(os.path.dirname(track), exist_ok=True)
+			shutil.copy(os.path.join(testdata, track), track)
+
+	def setup(self, track, sidecar):
+		from PyQt5 import QtWidgets
+		self.app=QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+		prohic.monoFont='Mono'
+		prohic.dpr=1
+		self.window=prohic.BrowserWindow()
+		self.track=os.path.abspath(track)
+		self.window.importTrack(self.track) #writes the sidecar
+
+	def importTrack(self, sidecar):
+		if sidecar=='cold':
+			for path in glob.glob(self.track+'.prohic.npz'):
+				os.remove(path)
+		self.window.importTrack(self.track)
+
+	def time_importTrack(self, track, sidecar):
+		self.importTrack(sidecar)
+
+	def peakmem_importTrack(self, track, sidecar):
+		self.importTrack(sidecar)
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+try:
+	from .sidecars import loadSidecar, saveSidecar
+except:
+	from sidecars import loadSidecar, saveSidecar
+
+cacheVersion=1
+
+
+def coolerWeights(clr, check=None): #Balancing weights of a cooler without a weight column, computed once per file and resolution and kept in a sidecar
+	st=os.stat(clr.filename)
+	key=np.array([cacheVersion, st.st_size, st.st_mtime_ns, clr.binsize or 0], dtype=np.int64)
+	name='{}.{}.weights'.format(clr.filename, clr.binsize)
+	path=loadSidecar(name, key)
+	if path is not None:
+		with np.load(path) as f:
+			return f['weights']
+	weights=iterativeCorrection(clr, check=check)
+	saveSidecar(name, key, weights=weights)
+	return weights
+
+
+def iterativeCorrection(clr, ignoreDiags=2, minNnz=10, madMax=5, tol=1e-5, maxIter=200, chunk=2**22, check=None): #ICE over the pixel table of a circular genome, bins near the origin are neighbours; weights as of cooler balance, NaN for filtered bins
+	n=clr.shape[0]
+	rows,cols,counts=[],[],[]
+	pixels=clr.pixels()
+	for lo in range(0, clr.info['nnz'], chunk):
+		p=pixels[lo:lo+chunk]
+		i,j=p['bin1_id'].values, p['bin2_id'].values
+		dist=(j-i)%n
+		far=np.minimum(dist, n-dist)>=ignoreDiags #diagonals are ignored across the origin too
+		rows.append(i[far].astype(np.int32))
+		cols.append(j[far].astype(np.int32))
+		counts.append(p['count'].values[far].astype(np.float64))
+		if check is not None:
+			check()
+	i,j,v=(np.concatenate(a) if a else np.zeros(0, dtype=t) for a,t in ((rows, np.int32), (cols, np.int32), (counts, np.float64)))
+
+	good=(np.bincount(i, minlength=n)+np.bincount(j, minlength=n))>=minNnz
+	marg=np.bincount(i, weights=v, minlength=n)+np.bincount(j, weights=v, minlength=n)
+	logMarg=np.log(marg[good&(marg>0)])
+	if madMax and len(logMarg):
+		med=np.median(logMarg)
+		good&=marg>=np.exp(med-madMax*np.median(np.abs(logMarg-med)))
+	keep=good[i]&good[j]
+	i,j,v=i[keep],j[keep],v[keep]
+
+	bias=good.astype(np.float64)
+	for it in range(maxIter):
+		w=v*bias[i]*bias[j]
+		marg=np.bincount(i, weights=w, minlength=n)+np.bincount(j, weights=w, minlength=n)
+		marg/=marg[good].mean() if good.any() else 1
+		marg[~good]=1
+		bias/=marg
+		if check is not None:
+			check()
+		if marg[good].var()<tol:
+			break
+	w=v*bias[i]*bias[j]
+	marg=np.bincount(i, weights=w, minlength=n)+np.bincount(j, weights=w, minlength=n)
+	scale=marg[good].mean() if good.any() else 1
+	bias/=np.sqrt(scale) #balanced rows sum to about 1
+	bias[~good]=np.nan
+	return bias
@@ -0,0 +1,60 @@
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+try:
+	from .sidecars import loadSidecar, saveSidecar
+except:
+	from sidecars import loadSidecar, saveSidecar
+
+cacheVersion=1
+
+
+def openMatrix(fname): #Square matrix of .npy/.npz (memory-mapped unless compressed) or numpy savetxt file (via a binary sidecar)
+	if fname.endswith('.npy'):
+		data=np.load(fname, mmap_mode='r')
+	elif fname.endswith('.npz'):
+		data=npzMember(fname)
+		if data is None: #compressed
+			with np.load(fname) as f:
+				data=f['matrix' if 'matrix' in f.files else f.files[0]]
+	else:
+		data=textMatrix(fname)
+	if data.ndim!=2 or data.shape[0]!=data.shape[1]:
+		raise ValueError('Not a square matrix: '+os.path.basename(fname))
+	return data
+
+
+def npzMember(fname, name=None): #Memory-mapped array stored in .npz without compression, None if compressed
+	with zipfile.ZipFile(fname) as z:
+		names=z.namelist()
+		if name is None:
+			name='matrix' if 'matrix.npy' in names else names[0][:-4]
+		info=z.getinfo(name+'.npy')
+	if info.compress_type!=zipfile.ZIP_STORED:
+		return None
+	with open(fname, 'rb') as f:
+		f.seek(info.header_offset)
+		nameLen,extraLen=struct.unpack('<HH', f.read(30)[26:30]) #local file header
+		f.seek(info.header_offset+30+nameLen+extraLen)
+		version=np.lib.format.read_magic(f)
+		if version==(1, 0):
+			shape,fortran,dtype=np.lib.format.read_array_header_1_0(f)
+		else:
+			shape,fortran,dtype=np.lib.format.read_array_header_2_0(f)
+		offset=f.tell()
+	return np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran else 'C')
+
+
+def textMatrix(fname): #Text matrix parsed once, then memory-mapped from the sidecar while the file is unchanged
+	st=os.stat(fname)
+	key=np.array([cacheVersion, st.st_size, st.st_mtime_ns], dtype=np.int64)
+	path=loadSidecar(fname, key)
+	if path is not None:
+		return npzMember(path, 'matrix')
+	import pandas as pd
+	data=pd.read_csv(fname, sep=r'\s+', header=None, comment='#', dtype=np.float64).to_numpy()
+	path=saveSidecar(fname, key, matrix=data)
+	return data if path is None else npzMember(path, 'matrix')
@@ -0,0 +1,119 @@
+import atexit
+from collections import deque
+from contextlib import contextmanager
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Profiler(): #Times user actions and their stages, records them as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+
+	def __init__(self):
+		self.file=None #trace file, profiling is off without it
+		self.events=deque(maxlen=200000)
+		self.start=time.perf_counter()
+		self.current=None #last action: {'name', 'start', 'end', 'stages':{stage: seconds}}
+		self.local=threading.local() #action running on this thread, or attached to it
+		self.threads=set()
+		self.lock=threading.Lock()
+		self.listeners=[] #called from any thread after an action or a stage
+
+	def enable(self, file):
+		if self.file is None:
+			atexit.register(self.write)
+		self.file=file
+
+	def enabled(self):
+		return self.file is not None
+
+	@contextmanager
+	def action(self, name): #User action, stages timed within it (also later, on other threads) are attributed to it
+		if self.file is None:
+			yield
+			return
+		action={'name':name, 'start':time.perf_counter(), 'end':0, 'stages':{}}
+		self.current=action
+		with self.attach(action):
+			try:
+				yield
+			finally:
+				self.record(name, 'action', action['start'], time.perf_counter(), action)
+				self.notify()
+
+	@contextmanager
+	def stage(self, name, notify=True): #Part of the running action, stages outside actions (paints, panning) are only traced; notify=False in paint to avoid feedback
+		if self.file is None:
+			yield
+			return
+		action=self.active()
+		start=time.perf_counter()
+		try:
+			yield
+		finally:
+			end=time.perf_counter()
+			self.record(name, 'stage', start, end, action)
+			if action is not None:
+				with self.lock:
+					action['stages'][name]=action['stages'].get(name, 0)+end-start
+			if notify and action is not None:
+				self.notify()
+
+	def active(self): #Action running on this thread or attached to it, None outside actions
+		return getattr(self.local, 'action', None)
+
+	@contextmanager
+	def attach(self, action): #Attribute stages of this thread to an action started elsewhere
+		previous=self.active()
+		self.local.action=action
+		try:
+			yield
+		finally:
+			self.local.action=previous
+
+	def record(self, name, category, start, end, action):
+		thread=threading.current_thread()
+		with self.lock:
+			if action is not None:
+				action['end']=max(action['end'], end)
+			if thread.ident not in self.threads:
+				self.threads.add(thread.ident)
+				self.events.append({'name':'thread_name', 'ph':'M', 'pid':os.getpid(), 'tid':thread.ident,
+					'args':{'name':thread.name}})
+			self.events.append({'name':name, 'cat':category, 'ph':'X', 'pid':os.getpid(), 'tid':thread.ident,
+				'ts':(start-self.start)*1e6, 'dur':(end-start)*1e6, 'args':{'action':action['name'] if action else ''}})
+
+	def notify(self):
+		for listener in self.listeners:
+			listener()
+
+	def breakdown(self): #Lines "name ms" of the last action: its duration up to the last stage, then the stages
+		action=self.current
+		if action is None:
+			return []
+		with self.lock:
+			stages=sorted(action['stages'].items(), key=lambda i: -i[1])
+			total=max(action['end'], action['start'])-action['start']
+		return [(action['name'], total*1000)]+[(name, t*1000) for name,t in stages]
+
+	def write(self):
+		if self.file is None:
+			return
+		with self.lock:
+			events=list(self.events)
+		with open(self.file, 'w') as f:
+			json.dump({'traceEvents':events, 'displayTimeUnit':'ms'}, f)
+
+
+profiler=Profiler()
+
+
+def timed(name): #Decorator timing a method as a user action
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			with profiler.action(name):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
@@ -1,10 +1,16 @@
+from collections import OrderedDict
+import copy
+import functools
 import math
+import os
 from os.path import basename
-from random import uniform
 import sys
+import threading
+import time
+startupTime=time.perf_counter() #for --startup-profile
 
-import cooler
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from pgcolorbar.colorlegend import ColorLegendItem
 from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtCore import Qt, pyqtSignal, QSize
@@ -12,13 +18,24 @@ import pyqtgraph as pg
 
 try:
 	from .colormaps import colormaps # launch with terminal command
+	from .tracks import readTrack, isTabix, TabixTrack
+	from .profiler import profiler, timed
+	from .matrices import openMatrix
+	from .balancing import coolerWeights
+	from .statscache import StatsStore, StoredDict
 except:
 	from colormaps import colormaps # launch directly
+	from tracks import readTrack, isTabix, TabixTrack
+	from profiler import profiler, timed
+	from matrices import openMatrix
+	from balancing import coolerWeights
+	from statscache import StatsStore, StoredDict
 
 class BrowserWindow(pg.GraphicsLayoutWidget):
 
 	shiftChanged = pyqtSignal(float)
 	sizeChanged = pyqtSignal(int)
+	profiled = pyqtSignal() #an action or its stage was timed, maybe on a worker thread
 
 	def __init__(self):
 
@@ -30,14 +47,16 @@ class BrowserWindow(pg.GraphicsLayoutWidget):
 		buttons.extend((Button('Open map (O)', self.open, enabled=True),
 			Button('Close map (Q)', self.close),
 			Button('Resolution (R)', self.resolution),
+			Button('Auto resolution (A)', self.autores),
 			Button('Color palette (C)', self.colormap, enabled=True),
 			Button('Observed/expected (E)', self.oe),
 			Button('Logarithmic color (L)', self.log),
 			Button('Tilt map (T)', self.tilt),
 			Button('Open track (B)', self.bed, enabled=True),
 			Button('Shift left (←)', self.left),
-			Button('Shift right (→)', self.right)))
-		for i in (1,2,4,5,6,8,9):
+			Button('Shift right (→)', self.right),
+			Button('Compare maps (D)', self.compare)))
+		for i in (1,2,3,5,6,7,9,10,11):
 			self.sizeChanged.connect(buttons[i].act)
 		for i in buttons:
 			buttonLayout.addItem(i)
@@ -71,7 +90,7 @@ class BrowserWindow(pg.GraphicsLayoutWidget):
 		self.plot.getAxis('left').setWidth(70)
 		self.plot.setContentsMargins(-5, 0, 0, 0)
 
-		self.mapColorBar = ColorLegendItem(imageItem=self.image, showHistogram=True)
+		self.mapColorBar = MyColorLegend(imageItem=self.image, showHistogram=True)
 		self.mapColorBar.resetRangeMouseButtons = [QtCore.Qt.RightButton]
 		self.mapColorBar.axisItem.setWidth(50)
 		self.mapColorBar.mainLayout.setContentsMargins(15, 0, 0, 0)
@@ -83,8 +102,22 @@ class BrowserWindow(pg.GraphicsLayoutWidget):
 		self.setWindowTitle('ProHiC')
 		
 		self.tracksOpened=0
+		self.tiltDistance=None #largest distance from the diagonal shown by the tilted map, bp
 		self.shiftEdge=5000
 		self.HiC=hicInterface()
+		self.mapViewBox.sigRangeChanged.connect(lambda *args: self.schedule(view=True))
+		self.mapViewBox.shiftDragged.connect(self.drag)
+		self.pending={'shift':0, 'view':False} #intents since the last frame
+		self.frameTimer=QtCore.QTimer(singleShot=True, interval=16, timeout=self.frame) #about 60 frames per second
+		self.taskId=0 #id of the latest request, older ones are cancelled
+		self.tasks=set()
+		self.blockId=0 #id of the latest block read, older ones are cancelled
+		self.levelId=0 #id of the latest level switch
+		self.levelRes=None #auto resolution level being prepared
+		self.target=self.state(self.HiC) #map state requested by the user
+		self.profileTimer=QtCore.QTimer(singleShot=True, interval=300, timeout=self.showProfile)
+		self.profiled.connect(self.profileTimer.start)
+		profiler.listeners.append(self.profiled.emit)
 
 		self.showMaximized()
 
@@ -98,6 +131,9 @@ class BrowserWindow(pg.GraphicsLayoutWidget):
 
 		elif event.key()==82: #R
 			self.resolution()
+
+		elif event.key()==65: #A
+			self.autores()
 			
 		elif event.key()==67: #C
 			self.colormap()
@@ -120,188 +156,392 @@ class BrowserWindow(pg.GraphicsLayoutWidget):
 		elif event.key()==66: #B
 			self.bed()
 
+		elif event.key()==68: #D
+			self.compare()
+
+		elif event.key()==16777216: #Esc
+			self.cancel()
+
 	#User control functions:
+	@timed('open')
 	def open(self):
-		firstTime=True if self.HiC.name=='' else False
 		fname, suc = opendialog('Open HiC map')
-		if suc:
-			if self.HiC.open(file=fname):
-				self.image.setImage(self.HiC.product())
-				self.image.setScale(self.HiC.res)
-				self.luah.update(closed=False, bname=self.HiC.bname, sizebp=self.HiC.sizebp, res=self.HiC.res, log=self.HiC.log, oe=self.HiC.oe, shift=int(self.HiC.shift*self.HiC.sizebp/100))
-				self.sizeChanged.emit(self.HiC.sizebp)
-
-				if self.tracksOpened==0 and firstTime: 
-					self.plot.autoRange()
-				elif self.tracksOpened!=0 and firstTime:
-					diapX,diapY=self.mapViewBox.state['viewRange']
-					self.mapViewBox.setYRange(max=(diapX[0]+diapX[1])/2+(diapY[1]-diapY[0])/2, 
-						min=(diapX[0]+diapX[1])/2-(diapY[1]-diapY[0])/2, padding=0)
-				
-				self.mapColorBar.autoScaleFromImage()
+		if suc and (fname[-3:]==".np" or fname[-4:] in (".npy", ".npz")): #bare matrices need the bin size
+			res, suc = intdialog('Bin size', 'Bin size of '+basename(fname)+', bp', self.target['res'] if self.HiC.matrix is not None else 1)
+			if suc:
+				self.request('Reading '+basename(fname), reopen=True, file=fname, res=res, compare=None)
+		elif suc:
+			self.request('Reading '+basename(fname), reopen=True, file=fname, compare=None)
 
+	@timed('close')
 	def close(self):
+		self.cancel()
 		if self.HiC.name!='':
 			self.shiftChanged.emit(-self.HiC.sizebp/100*self.HiC.shift)
 		self.HiC.close()
+		self.target=self.state(self.HiC)
 		self.plot.disableAutoRange()
 		self.image.clear()
 		#self.image.setScale(1)
 		self.luah.update(closed=True)
 		self.sizeChanged.emit(self.HiC.sizebp)
 
+	@timed('resolution')
 	def resolution(self):
 		if self.HiC.name!='':
 			res, suc = selectdialog(self.HiC.resolutions, 'Set resolution')
 			if suc:
-				self.HiC.open(file=self.HiC.name, resolution=int(res))
-				self.image.setImage(self.HiC.product())
-				self.image.setScale(self.HiC.res)
-				self.luah.update(res=self.HiC.res, sizebp=self.HiC.sizebp)
+				self.request('Reading '+res+' bp', res=int(res), autoRes=False)
+
+	@timed('auto resolution')
+	def autores(self):
+		if self.HiC.name[-6:]=='.mcool': #other maps have one level
+			self.request('Switching resolution mode', reopen=True, autoRes=not self.target['autoRes'])
 
+	@timed('colormap')
 	def colormap(self):
 		cm, suc = selectdialog(colormaps, 'Set colormap')
 		if suc:
 			self.mapColorBar.setLut(makeLUT(cm))
 			self.luah.update(colormap=cm)
 
+	@timed('O/E')
 	def oe(self):
 		if self.HiC.name!='':
-			self.HiC.toggleOE()
-			self.image.setImage(self.HiC.product())
-			self.luah.update(oe=self.HiC.oe)
-			self.mapColorBar.autoScaleFromImage()
+			self.request('Computing O/E', oe=not self.target['oe'])
 
+	@timed('log')
 	def log(self):
 		if self.HiC.name!='':
-			self.HiC.toggleLOG()
-			self.image.setImage(self.HiC.product())
-			self.luah.update(log=self.HiC.log)
-			self.mapColorBar.autoScaleFromImage()
+			self.request('Scaling', log=not self.target['log'])
 
-	def right(self):
+	def right(self): #shifts are applied on the next frame, key repeats in between add up
 		if self.HiC.name!='':
-			self.HiC.changeShift(1)
-			self.image.setImage(self.HiC.product())
-			self.luah.update(shift=int(self.HiC.shift*self.HiC.sizebp/100))
-			self.shiftChanged.emit(self.HiC.sizebp/100)
+			self.schedule(shift=1)
 
 	def left(self):
 		if self.HiC.name!='':
-			self.HiC.changeShift(-1)
-			self.image.setImage(self.HiC.product())
-			self.luah.update(shift=int(self.HiC.shift*self.HiC.sizebp/100))
-			self.shiftChanged.emit(-self.HiC.sizebp/100)
+			self.schedule(shift=-1)
 
+	def drag(self, bp): #Shift+drag on the map or a track
+		if self.HiC.name!='':
+			self.schedule(shift=bp/self.HiC.sizebp*100)
+
+	@timed('tilt')
 	def tilt(self):
 		if self.HiC.name!='':
+			if not self.image.tilted and not self.HiC.lazy(): #only the band up to this distance is drawn
+				distance, suc = intdialog('Tilt map', 'Largest distance from the diagonal, bp', self.tiltDistance or self.HiC.sizebp//2)
+				if not suc:
+					return
+				self.tiltDistance=distance
 			self.plot.disableAutoRange()
 			diapX,diapY=self.mapViewBox.state['viewRange']
-			if self.image.tilt() == True:
+			tilted=self.image.tilt()
+			self.showMap()
+			if tilted == True:
 				self.mapViewBox.setYRange(diapY[0]-diapY[1], 0, padding=0)
 			else:
 				self.mapViewBox.setYRange(max=(diapX[0]+diapX[1])/2+(diapY[1]-diapY[0])/2, 
 					min=(diapX[0]+diapX[1])/2-(diapY[1]-diapY[0])/2, padding=0)
 
+	@timed('open track')
 	def bed(self):
 		fname, suc = opendialog('Open track')
 		if suc:
 			self.importTrack(fname)
+
+	@timed('compare')
+	def compare(self): #Show the map against a second cooler with the same bins, or back alone
+		if self.HiC.name=='':
+			return
+		if self.target['compare'] is not None:
+			self.request('Reading '+self.HiC.bname, reopen=True, compare=None)
+			return
+		fname, suc = opendialog('Open map to compare with')
+		if suc:
+			mode, suc = selectdialog(['ratio', 'difference'], 'Compare maps')
+			if suc:
+				self.request('Comparing with '+basename(fname), reopen=True, compare=fname, compareMode=mode, autoRes=False)
 	#End of user control functions
 
+	def schedule(self, shift=0, view=False): #Add an intent (shift in % of the genome, view change), their net result is drawn on the next frame
+		self.pending['shift']+=shift
+		self.pending['view']|=view
+		if not self.frameTimer.isActive():
+			self.frameTimer.start()
+
+	def frame(self):
+		shift,view=self.pending['shift'],self.pending['view']
+		self.pending={'shift':0, 'view':False}
+		if shift and self.HiC.name!='':
+			with profiler.action('shift'):
+				self.HiC.changeShift(shift)
+				self.rollMap()
+				self.luah.update(shift=int(self.HiC.shift*self.HiC.sizebp/100))
+				with profiler.stage('tracks'):
+					self.shiftChanged.emit(shift*self.HiC.sizebp/100)
+		elif view:
+			self.viewChanged()
+
+	def state(self, hic):
+		return {'file':hic.name, 'res':hic.res, 'oe':hic.oe, 'log':hic.log, 'autoRes':hic.autoRes,
+			'compare':hic.compare, 'compareMode':hic.compareMode}
+
+	def request(self, status, reopen=False, **changes): #Load and process the map on a worker thread, superseding older requests
+		self.target.update(changes)
+		target=dict(self.target)
+		firstTime=self.HiC.name==''
+		hic=copy.copy(self.HiC) #the shown map stays intact until the result is ready
+		action=profiler.active() #stages of the worker belong to the action that started it
+		def job(check):
+			hic.check=check
+			try:
+				with profiler.attach(action):
+					hic.oe,hic.log,hic.autoRes=target['oe'],target['log'],target['autoRes']
+					hic.compare,hic.compareMode=target['compare'],target['compareMode']
+					if reopen or (hic.name, hic.res)!=(target['file'], target['res']):
+						ok=hic.open(file=target['file'], resolution=target['res'])
+					else:
+						hic.process()
+						ok=True
+			finally:
+				hic.check=None
+			return hic, ok
+		self.taskId+=1
+		taskId=self.taskId
+		task=Task(job, superseded=lambda: taskId!=self.taskId)
+		task.signals.progress.connect(lambda stage: self.taskProgress(taskId, stage))
+		task.signals.finished.connect(lambda result: self.taskDone(task, taskId, result, firstTime, action=action))
+		task.signals.failed.connect(lambda message: self.taskDone(task, taskId, None, firstTime, message))
+		task.signals.cancelled.connect(lambda: self.tasks.discard(task))
+		self.tasks.add(task)
+		self.luah.update(status=status)
+		self.setCursor(Qt.BusyCursor)
+		QtCore.QThreadPool.globalInstance().start(task)
+
+	def cancel(self): #Forget running requests, they stop at their next stage
+		self.taskId+=1
+		self.target=self.state(self.HiC)
+		self.luah.update(status='')
+		self.unsetCursor()
+
+	def taskProgress(self, taskId, stage):
+		if taskId==self.taskId:
+			self.luah.update(status=stage)
+
+	def taskDone(self, task, taskId, result, firstTime, message=None, action=None):
+		self.tasks.discard(task)
+		if taskId!=self.taskId: #superseded
+			return
+		self.luah.update(status='')
+		self.unsetCursor()
+		if result is None:
+			self.target=self.state(self.HiC)
+			errordialog(message)
+			return
+		hic,ok=result
+		if not ok:
+			self.target=self.state(self.HiC)
+			return
+		with profiler.attach(action):
+			self.mapLoaded(hic, firstTime)
+		self.target=self.state(self.HiC)
+
+	def showProfile(self): #Breakdown of the last action on the board, the trace is written on exit
+		self.luah.update(timing=profiler.breakdown())
+
+	def mapLoaded(self, hic, firstTime): #Show the map prepared by a request
+		old,self.HiC=self.HiC,hic
+		hic.shift=old.shift #shifts made while loading
+		hic.hold()
+		self.image.setScale(hic.res)
+		self.showMap()
+		self.luah.update(closed=False, bname=hic.bname, compare=basename(hic.compare) if hic.compare else '', mode=hic.compareMode, sizebp=hic.sizebp, res=hic.res, log=hic.log, oe=hic.oe, autores=hic.autoRes, shift=int(hic.shift*hic.sizebp/100))
+		self.sizeChanged.emit(hic.sizebp)
+
+		if self.tracksOpened==0 and firstTime: 
+			self.plot.autoRange()
+		elif self.tracksOpened!=0 and firstTime:
+			diapX,diapY=self.mapViewBox.state['viewRange']
+			self.mapViewBox.setYRange(max=(diapX[0]+diapX[1])/2+(diapY[1]-diapY[0])/2, 
+				min=(diapX[0]+diapX[1])/2-(diapY[1]-diapY[0])/2, padding=0)
+
+		if (old.mapKey(), old.oe, old.log)!=(hic.mapKey(), hic.oe, hic.log):
+			with profiler.stage('colorbar'):
+				self.mapColorBar.autoScaleFromImage()
+
+	def showMap(self): #Put the processed map, or in lazy mode its visible part, on the image
+		if self.HiC.lazy():
+			n=self.HiC.size
+			if self.image.mapBins!=n: #blank map until its first block is read, the view can span it meanwhile
+				self.image.setMap(n)
+			self.viewChanged(force=True)
+		else:
+			with profiler.stage('image and histogram'):
+				self.mapColorBar.histogram=self.HiC.histogram()
+				if self.image.tilted:
+					self.image.setBlock(self.HiC.band(self.tiltDistance), band=True)
+				else:
+					self.image.setBlock(self.HiC.product(rolled=False), codes=self.HiC.codes)
+			self.rollMap()
+
+	def rollMap(self):
+		if self.HiC.lazy():
+			self.viewChanged(force=True)
+		else:
+			self.image.setRoll(self.HiC.offset())
+
+	def viewChanged(self, force=False): #Lazy mode: read the visible part of the map with a margin
+		if not self.HiC.lazy():
+			return
+		if self.HiC.autoRes:
+			res=self.HiC.autoLevel(self.mapViewBox.viewPixelSize()[0])
+			if res not in (None, self.HiC.res, self.levelRes):
+				self.switchLevel(res)
+		n=self.HiC.size
+		r0,r1,c0,c1=self.image.binRect(self.mapViewBox.viewRect())
+		r0,c0=max(0, int(r0)),max(0, int(c0))
+		r1,c1=min(n, int(math.ceil(r1))),min(n, int(math.ceil(c1)))
+		if r1<=r0 or c1<=c0: #map is out of view
+			return
+		binsPerPixel=self.mapViewBox.viewPixelSize()[0]/self.HiC.res
+		stride=2**int(math.log2(binsPerPixel)) if binsPerPixel>1 else 1
+		if not force and self.image.covers(r0, r1, c0, c1, stride):
+			return
+		mr,mc=(r1-r0)//2,(c1-c0)//2
+		r0,r1=max(0, r0-mr)//stride*stride,min(n, r1+mr)
+		c0,c1=max(0, c0-mc)//stride*stride,min(n, c1+mc)
+		self.blockId+=1
+		if self.HiC.tiles is None: #cells are in memory already
+			self.blockRead(self.blockId, self.HiC, self.HiC.block(r0, r1, c0, c1, stride), (r0, c0), stride)
+		else:
+			self.readBlock(r0, r1, c0, c1, stride)
+
+	def switchLevel(self, res): #Auto resolution: prepare another level on a worker thread, blocks of the shown one are read meanwhile
+		hic=self.HiC
+		level=copy.copy(hic)
+		self.levelId+=1
+		levelId=self.levelId
+		self.levelRes=res
+		action=profiler.active()
+		def job(check):
+			level.check=check
+			try:
+				with profiler.attach(action):
+					level.setLevel(res)
+					level.process()
+			finally:
+				level.check=None
+			return level
+		task=Task(job, superseded=lambda: levelId!=self.levelId or hic is not self.HiC)
+		task.signals.finished.connect(lambda level: self.levelDone(task, levelId, hic, level))
+		task.signals.failed.connect(lambda message: self.levelDone(task, levelId, hic, None, message))
+		task.signals.cancelled.connect(lambda: self.levelDone(task, levelId, hic, None))
+		self.tasks.add(task)
+		QtCore.QThreadPool.globalInstance().start(task)
+
+	def levelDone(self, task, levelId, hic, level, message=None): #Swap the prepared level in, unless the map has changed
+		self.tasks.discard(task)
+		if levelId!=self.levelId:
+			return
+		self.levelRes=None
+		if hic is not self.HiC:
+			return
+		if level is None:
+			if message is not None:
+				errordialog(message)
+			return
+		level.shift=hic.shift #shifts made meanwhile
+		self.HiC=level
+		level.hold()
+		self.target['res']=level.res
+		self.image.rescale(level.res, level.size)
+		self.luah.update(res=level.res, sizebp=level.sizebp)
+		if level.sizebp!=hic.sizebp: #last bin may differ in size between levels
+			self.sizeChanged.emit(level.sizebp)
+		self.viewChanged(force=True)
+
+	def readBlock(self, r0, r1, c0, c1, stride): #Read tiles of a block and ahead of it on a worker thread, the shown map stays as is meanwhile
+		hic=self.HiC
+		reader=copy.copy(hic) #own check and last blocks, caches are shared
+		blockId=self.blockId
+		action=profiler.active()
+		def job(check):
+			reader.check=check
+			with profiler.attach(action):
+				return reader.block(r0, r1, c0, c1, stride)
+		task=Task(job, superseded=lambda: blockId!=self.blockId or hic is not self.HiC)
+		task.signals.finished.connect(lambda block: (self.tasks.discard(task), self.blockRead(blockId, hic, block, (r0, c0), stride, reader)))
+		task.signals.failed.connect(lambda message: self.blockFailed(task, blockId, message))
+		task.signals.cancelled.connect(lambda: self.tasks.discard(task))
+		self.tasks.add(task)
+		QtCore.QThreadPool.globalInstance().start(task)
+
+	def blockFailed(self, task, blockId, message):
+		self.tasks.discard(task)
+		if blockId==self.blockId:
+			errordialog(message)
+
+	def blockRead(self, blockId, hic, block, origin, stride, reader=None): #Show a block read for the map, unless it is outdated
+		if blockId!=self.blockId or hic is not self.HiC:
+			return
+		if reader is not None:
+			hic.lastBlock,hic.prevBlock,hic.lastStride=reader.lastBlock,reader.prevBlock,reader.lastStride
+		with profiler.stage('image and histogram'):
+			self.mapColorBar.histogram=hic.histogram()
+			self.image.setBlock(block, origin=origin, stride=stride, mapBins=hic.size)
+		if reader is not None:
+			self.prefetch(blockId, hic)
+
+	def prefetch(self, blockId, hic): #Read ahead on a worker thread until the next block is asked for
+		reader=copy.copy(hic)
+		def job(check):
+			reader.check=check
+			reader.prefetch()
+		task=Task(job, superseded=lambda: blockId!=self.blockId or hic is not self.HiC)
+		for signal in (task.signals.finished, task.signals.failed, task.signals.cancelled):
+			signal.connect(lambda *args: self.tasks.discard(task))
+		self.tasks.add(task)
+		QtCore.QThreadPool.globalInstance().start(task)
+
 	def importTrack(self, fname): #Parse given file and draw the data
 
 		with pg.BusyCursor():
 
-			if fname[-4:]==".bed":
-				
-				starts,ends,names = np.genfromtxt(
-					fname=fname, 
-					delimiter="\t", 
-					dtype=None, 
-					usecols=(1,2,3), 
-					unpack=True, 
-					encoding=None, 
-					comments='track')
-				
-				track=Track(curve=False, name=basename(fname).split('.')[0])
-				sh=self.HiC.shift*self.HiC.sizebp/100
-
-				for i in range(len(starts)): #Draw lines
-					a=Region(
-						x=[starts[i]+sh, ends[i]+sh], 
-						nameOfReg=names[i], mapsize=self.HiC.sizebp,
-						direction='0')
-					track.addItem(a)
-					self.shiftChanged.connect(a.mov)
-					self.sizeChanged.connect(a.siz)
-
-				self.addTrack(track)
-
-			elif fname[-4:] in (".gff", "gff2", 'gff3'):
-				
-				featureType,starts,ends,strand,featureName = np.genfromtxt(
-					fname=fname, 
-					delimiter="\t", 
-					dtype=None, 
-					usecols=(2,3,4,6,8), 
-					unpack=True, 
-					encoding=None, 
-					comments='#')
-
-				names=[featureType[i]+'\n'+featureName[i] for i in range(len(featureType))]
-				
-				toPop=[]
-				for i in range(len(starts)-1):
-					if starts[i]==starts[i+1]:
-						toPop.append(i+1)
-						names[i]+='\n\n'+names[i+1]
-				starts=np.delete(starts, toPop)
-				ends=np.delete(ends, toPop)
-				names=np.delete(names, toPop)
-
-				track=Track(curve=False, name=basename(fname).split('.')[0])
-				sh=self.HiC.shift*self.HiC.sizebp/100
-
-				for i in range(len(starts)):
-					a=Region(
-						x=[starts[i]+sh, ends[i]+sh], 
-						nameOfReg=names[i], 
-						mapsize=self.HiC.sizebp,
-						direction=strand[i])
-					track.addItem(a)
-					self.shiftChanged.connect(a.mov)
-					self.sizeChanged.connect(a.siz)
-
-				self.addTrack(track)
-
-			elif fname[-9:]==".bedgraph":
-				starts,ends,values = np.genfromtxt(
-					fname=fname, 
-					delimiter="\t", 
-					dtype=None, 
-					usecols=(1,2,3), 
-					unpack=True, 
-					encoding=None, 
-					comments='track')
-				
-				track=Track(curve=True, name=basename(fname).split('.')[0])
-
-				starts=[i+self.HiC.shift*self.HiC.sizebp/100 for i in starts]
-				ends=[i+self.HiC.shift*self.HiC.sizebp/100 for i in ends]
-				xset=[(starts[i]+ends[i])/2 for i in range(len(starts))]
-				yset=values
-				dataList=[(xset[i],yset[i]) for i in range(len(xset))]
-				curveData=np.array(dataList, dtype=[('x', 'f'), ('y', 'f')])
-
-				a=Curve(curveData=curveData, 
+			try:
+				if isTabix(fname): #only the records around the view are read
+					feed=TabixFeed(fname)
+					fmt,cols=feed.source.fmt,feed.source.parse([], 0, 0)
+				else:
+					feed=None
+					with profiler.stage('parsing'):
+						fmt,cols=readTrack(fname)
+			except Exception as e:
+				errordialog('Cannot read '+basename(fname)+':\n'+str(e))
+				return
+
+			name=basename(fname).split('.')[0]
+			shift=self.HiC.shift*self.HiC.sizebp/100
+
+			if fmt in ('bed', 'gff'):
+
+				track=Track(curve=False, name=name)
+				a=Features(*featureArrays(fmt, cols), 
+					mapsize=self.HiC.sizebp, shift=shift, feed=feed)
+
+			else:
+
+				track=Track(curve=True, name=name)
+				a=Curve(curveData=curveData(cols), 
 					pen='#DDD', 
-					mapsize=self.HiC.sizebp)
-				track.addItem(a)
-				self.shiftChanged.connect(a.mov)
-				self.sizeChanged.connect(a.siz)
+					mapsize=self.HiC.sizebp, shift=shift, feed=feed)
 
-				self.addTrack(track)
+			track.addItem(a)
+			self.shiftChanged.connect(a.mov)
+			self.sizeChanged.connect(a.siz)
+
+			self.addTrack(track)
 
 	def addTrack(self, track): #Add Track and Close button
 		
@@ -318,6 +558,7 @@ class BrowserWindow(pg.GraphicsLayoutWidget):
 		self.mainLayout.addItem(track)
 		
 		track.setXLink(self.plot)
+		track.getViewBox().shiftDragged.connect(self.drag)
 
 		btn=CloseButton(linkedTrack=track, height=100 if track.curve else 50, 
 			parentLayout=self.mainLayout, parentWindow=self)
@@ -326,11 +567,17 @@ class BrowserWindow(pg.GraphicsLayoutWidget):
 
 class hicInterface(): #Convinient envelope for cooler, also processing data and metadata
 
+	memoryBudget=int(os.environ.get('PROHIC_MEMORY_MB', 0))*2**20 #limit for the shown map and the kept ones together, 0 - none
+	cacheBudget=min(int(os.environ.get('PROHIC_CACHE_MB', 1024))*2**20, memoryBudget or 2**62) #memory for raw and processed matrices kept for reuse, the shown map included
+	dtype=np.float32 if os.environ.get('PROHIC_FLOAT32') else np.float64 #of the loaded and processed matrices
+	statsStore=StatsStore() #expected vectors, value ranges, histograms and resolution lists kept between sessions
+
 	def __init__(self):
 
 		self.clr=None
 		self.rawdata=np.zeros((2,2))
 		self.prepdata=np.zeros((2,2))
+		self.codes=None #prepdata quantized for display
 		self.name=''
 		self.bname=''
 		self.res=5000
@@ -340,58 +587,482 @@ class hicInterface(): #Convinient envelope for cooler, also processing data and
 		self.size=0
 		self.sizebp=0
 		self.resolutions=[] #available resolutions in other coolers
+		self.balance=True
+		self.expectedCache=StoredDict(self.statsStore, 'expected') #expected vectors per (file, resolution, balance)
+		self.statsCache=StoredDict(self.statsStore, 'stats') #value ranges (and samples of lazily opened maps) per (file, resolution, balance, oe)
+		self.histCache=StoredDict(self.statsStore, 'histogram') #(histogram, levels) for the legend per (file, resolution, balance, oe, log)
+		self.resolutionCache=StoredDict(self.statsStore, 'resolutions') #levels of .mcool files per (file,)
+		self.weightCache={} #weights computed for coolers without them per (file, group)
+		self.tiles=None #TileCache for maps too big to be loaded as a whole
+		self.sparse=None #SparseMatrix of a big cooler whose nonzero cells fit into memory, instead of tiles
+		self.prepvalues=None #processed values of the cells stored in sparse
+		self.matrix=None #memory-mapped numpy matrix
+		self.lazyBins=8192 #maps with more bins are read by tiles
+		self.lastBlock=None
+		self.prevBlock=None
+		self.lastStride=1 #stride of the last block
+		self.autoRes=False #choose the mcool level by zoom
+		self.compare=None #file of a second cooler with the same bins, the map then shows their ratio or difference
+		self.compareMode='ratio' #'ratio' (log2 with log scaling) or 'difference' of the balanced maps
+		self.pyramid=OrderedDict() #(clr, TileCache) of recently used levels per (file, resolution)
+		self.pyramidLock=threading.Lock() #the pyramid and caches are shared with copies working on other threads
+		self.maxLevels=3
+		self.cache=MatrixCache(self.cacheBudget) #raw maps per (file, resolution, balance) and products per (..., oe, log)
+		self.check=None #set while a worker thread runs this object, raises Cancelled if the request is superseded
 
 	def open(self, file, resolution=None):
+		import cooler #heavy (pandas, h5py), loaded with the first map
+		binsize=resolution or 1 #bare matrices carry no bin size
 		if resolution==None: resolution=self.res
+		self.step()
+		if self.compare is not None:
+			if file[-5:]!='.cool' and file[-6:]!='.mcool':
+				raise ValueError('Only coolers can be compared')
+			self.autoRes=False #levels are not combined
+		if file[-6:]!=".mcool":
+			self.autoRes=False #only an .mcool has levels
 		if file[-6:]==".mcool":
-			resolutions=[i.split('/')[-1] for i in cooler.fileops.list_coolers(file)]
+			resolutions=self.listResolutions(file)
 			if str(resolution) not in resolutions:
 				diffResList=list(enumerate([abs(int(i)-resolution) for i in resolutions]))
 				resolution=int(resolutions[min(diffResList, key=lambda i : i[1])[0]])
-			self.clr=cooler.Cooler(file+'::resolutions/'+str(resolution))
-			self.rawdata=self.clr.matrix(balance=True)[:, :]
 			self.name=file
-			self.res=resolution
 			self.resolutions=resolutions
+			if self.autoRes:
+				self.setLevel(resolution)
+			else:
+				resolution=self.fitBudget(file, resolution)
+				self.clr=cooler.Cooler(file+'::resolutions/'+str(resolution))
+				self.loadCooler()
+				self.res=resolution
 
 		elif file[-5:]==".cool":
 			self.clr=cooler.Cooler(file)
-			self.rawdata=self.clr.matrix(balance=True)[:, :]
+			if self.clr.shape[0]<=self.lazyBins:
+				self.checkBudget(self.clr.shape[0])
 			self.name=file
+			self.loadCooler()
 			self.res=int(self.clr.binsize)
 			self.resolutions=[str(self.clr.binsize)]
 
-		elif file[-3:]==".np": #numpy savetxt files
-			self.rawdata=np.loadtxt(file)
+		elif file[-3:]==".np" or file[-4:] in (".npy", ".npz"): #numpy matrices, resolution is their bin size
+			self.step('Reading '+basename(file))
+			with profiler.stage('reading'):
+				self.matrix=openMatrix(file) #memory-mapped, only the used part is read
+			n=self.matrix.shape[0]
+			self.clr=self.sparse=None
+			if n>self.lazyBins:
+				self.tiles=TileCache(fetch=lambda r0,r1,c0,c1: np.array(self.matrix[r0:r1, c0:c1], dtype=float), size=n,
+					sampled=lambda s: lambda q0,q1,p0,p1: np.array(self.matrix[q0*s:q1*s:s, p0*s:p1*s:s], dtype=float))
+				self.rawdata=None
+			else:
+				self.checkBudget(n)
+				self.tiles=None
+				self.rawdata=self.matrix if self.matrix.dtype==self.dtype else self.matrix.astype(self.dtype)
 			self.name=file
-			self.res=1
+			self.res=binsize
 			self.resolutions=[]
 
 		else:
 			return False
 
 		self.bname=basename(self.name)
-		self.size=self.rawdata.shape[0]		
+		self.size=(self.tiles or self.sparse).size if self.lazy() else self.rawdata.shape[0]
 		self.sizebp=self.size*self.res
 		self.process()
 		return True
 
+	def listResolutions(self, file): #Levels of an .mcool, kept with the statistics
+		key=(file,)
+		if key not in self.resolutionCache:
+			import cooler
+			self.resolutionCache[key]=np.array([i.split('/')[-1] for i in cooler.fileops.list_coolers(file)])
+		return [str(i) for i in self.resolutionCache[key]]
+
+	def loadCooler(self): #Dense matrix for small maps, tiles on demand for big ones
+		n=self.clr.shape[0]
+		if n>self.lazyBins:
+			if self.compare is not None:
+				raise ValueError('Maps of more than {} bins read by parts cannot be compared, choose a coarser resolution'.format(self.lazyBins))
+			self.rawdata=None
+			if self.sparseFits(self.clr):
+				self.tiles=None
+				self.sparse=self.readSparse(self.clr)
+			else:
+				self.tiles,self.sparse=self.coolerTiles(self.clr),None
+		else:
+			self.tiles=self.sparse=None
+			key=('raw', self.clr.filename, self.clr.root, self.balance)
+			if self.compare is not None: #O/E is taken of either map before they are combined
+				key+=(self.compare, self.compareMode, self.oe)
+			self.rawdata=self.cache.get(key)
+			if self.rawdata is None:
+				self.checkBudget(self.clr.shape[0])
+				self.step('Reading matrix')
+				with profiler.stage('cooler I/O'):
+					self.rawdata=self.cache.put(key, self.readMatrix(self.clr) if self.compare is None else self.readComparison(self.clr))
+
+	def readMatrix(self, clr, rows=1024): #Dense matrix in self.dtype, read by row bands into the output
+		n=clr.shape[0]
+		matrix=self.coolerMatrix(clr)
+		out=np.empty((n, n), dtype=self.dtype)
+		for r0 in range(0, n, rows):
+			r1=min(n, r0+rows)
+			out[r0:r1]=matrix[r0:r1, :]
+			self.step()
+		return out
+
+	def sparseFits(self, clr): #Nonzero cells of a big cooler and their processed values fit into the memory budget (the cache one if there is none)
+		itemsize=np.dtype(self.dtype).itemsize
+		return clr.storage_mode=='symmetric-upper' and clr.info['nnz']*(4+2*itemsize)<=(self.memoryBudget or self.cacheBudget)
+
+	def readSparse(self, clr): #Nonzero cells of a big map, cached as raw maps are
+		key=('sparse', clr.filename, clr.root, self.balance)
+		sparse=self.cache.get(key)
+		if sparse is None:
+			weights=self.weights(clr)
+			self.step('Reading pixels')
+			with profiler.stage('cooler I/O'):
+				sparse=SparseMatrix.fromCooler(clr, None if weights is False else
+					clr.bins()['weight'][:].values if weights is True else weights, dtype=self.dtype, check=self.step)
+			self.cache.put(key, sparse)
+		return sparse
+
+	def readComparison(self, clr, rows=1024): #Ratio or difference of clr and the compared cooler (o/e of each in O/E mode), read by row bands of both
+		other=self.compareCooler(clr)
+		n=clr.shape[0]
+		a,b=self.coolerMatrix(clr),self.coolerMatrix(other)
+		if self.oe:
+			expA,expB=self.coolerExpected(clr, self.name),self.coolerExpected(other, self.compare)
+		out=np.empty((n, n), dtype=self.dtype)
+		for r0 in range(0, n, rows):
+			r1=min(n, r0+rows)
+			x,y=a[r0:r1, :],b[r0:r1, :]
+			if self.oe:
+				dist=(np.arange(n)[None, :]-np.arange(r0, r1)[:, None])%n
+				x/=expA[dist]
+				y/=expB[dist]
+			if self.compareMode=='ratio':
+				np.divide(x, y, out=out[r0:r1])
+				out[r0:r1][(x==0)|(y==0)]=np.nan #no contacts in either map give no ratio
+			else:
+				np.subtract(x, y, out=out[r0:r1])
+			self.step()
+		return out
+
+	def compareCooler(self, clr): #Cooler of the compared file at the bins of clr
+		import cooler
+		name=basename(self.compare)
+		if self.compare[-6:]=='.mcool':
+			if str(clr.binsize) not in self.listResolutions(self.compare):
+				raise ValueError('{} has no {} bp resolution'.format(name, clr.binsize))
+			other=cooler.Cooler(self.compare+'::resolutions/'+str(clr.binsize))
+		elif self.compare[-5:]=='.cool':
+			other=cooler.Cooler(self.compare)
+		else:
+			raise ValueError('Only coolers can be compared')
+		if other.binsize!=clr.binsize or other.shape!=clr.shape or list(other.chromnames)!=list(clr.chromnames):
+			raise ValueError('Bins of {} differ from the map'.format(name))
+		return other
+
+	def coolerExpected(self, clr, file): #Expected vector of a cooler from its pixel table, cached per (file, resolution, balance)
+		key=(file, int(clr.binsize), self.balance)
+		if key not in self.expectedCache:
+			self.step('Computing expected')
+			with profiler.stage('expected'):
+				self.expectedCache[key]=scanPixels(clr, self.weights(clr), check=self.step)[0]
+		return self.expectedCache[key]
+
+	def mapKey(self): #Map part of cache keys: the file, or both files and the mode of a comparison
+		return self.name if self.compare is None else (self.name, self.compare, self.compareMode)
+
+	def mapBytes(self, n): #Memory needed to show a dense map: raw and processed matrices, display codes
+		return n*n*(2*np.dtype(self.dtype).itemsize+2)
+
+	def checkBudget(self, n): #Make room for a dense map in the memory budget, next to the shown one
+		if not self.memoryBudget or n>self.lazyBins:
+			return
+		if self.mapBytes(n)>self.memoryBudget:
+			raise MemoryError('Map of {} bins needs {:.1f} MB, more than the memory budget of {:.1f} MB (PROHIC_MEMORY_MB)'.format(
+				n, self.mapBytes(n)/2**20, self.memoryBudget/2**20))
+		self.cache.reserve(self.mapBytes(n))
+
+	def hold(self): #Count the arrays of the shown map in the cache budget, they are not evicted while shown
+		self.cache.hold([self.rawdata if not isinstance(self.rawdata, np.memmap) else None, self.prepdata, self.codes, self.sparse, self.prepvalues])
+
+	def fitBudget(self, file, resolution): #Finest .mcool level from the given one whose dense map fits into the memory budget
+		if not self.memoryBudget:
+			return resolution
+		import cooler
+		for res in sorted(int(i) for i in self.resolutions if int(i)>=resolution):
+			n=cooler.Cooler(file+'::resolutions/'+str(res)).shape[0]
+			if n>self.lazyBins or self.mapBytes(n)<=self.memoryBudget: #big maps are read by tiles anyway
+				if res!=resolution:
+					self.step('Memory budget: reading {} bp'.format(res))
+				return res
+		self.checkBudget(n)
+		return resolution
+
+	def weights(self, clr): #Balancing of clr: self.balance, or weights computed here if the cooler has none
+		if not self.balance or 'weight' in clr.bins().columns:
+			return self.balance
+		key=(clr.filename, clr.root)
+		if key not in self.weightCache:
+			self.step('Balancing')
+			with profiler.stage('balancing'):
+				self.weightCache[key]=coolerWeights(clr, check=self.step)
+		return self.weightCache[key]
+
+	def coolerMatrix(self, clr): #Matrix selector of clr, balanced as set
+		weights=self.weights(clr)
+		return clr.matrix(balance=weights) if isinstance(weights, bool) else WeightedMatrix(clr, weights)
+
+	def coolerTiles(self, clr):
+		matrix=self.coolerMatrix(clr)
+		return TileCache(fetch=lambda r0,r1,c0,c1: matrix[r0:r1, c0:c1], size=clr.shape[0], sampled=lambda stride: self.coolerSamples(clr, stride))
+
+	def coolerSamples(self, clr, stride): #Fetch of every stride-th bin of a cooler: pixels of the region are read and only those of sampled bins are kept
+		n=clr.shape[0]
+		weights=self.weights(clr)
+		if weights is True:
+			weights=clr.bins()['weight'][:].values
+		elif weights is False:
+			weights=np.ones(n)
+		pixels=clr.matrix(balance=False, sparse=True)
+		def fetch(q0, q1, p0, p1):
+			rows,cols=np.arange(q0, q1)*stride,np.arange(p0, p1)*stride
+			m=pixels[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1].tocoo()
+			keep=(m.row%stride==0)&(m.col%stride==0)
+			out=np.zeros((len(rows), len(cols)))
+			out[m.row[keep]//stride, m.col[keep]//stride]=m.data[keep]
+			return out*weights[rows][:, None]*weights[cols][None, :]
+		return fetch
+
+	def lazy(self):
+		return self.tiles is not None or self.sparse is not None
+
+	def step(self, stage=None): #Report progress to the worker, which may cancel the job here
+		if self.check is not None:
+			self.check(stage)
+
+	def getLevel(self, res): #Auto resolution: (clr, TileCache) of a level of the opened mcool
+		key=(self.name, res)
+		with self.pyramidLock:
+			if key not in self.pyramid:
+				import cooler
+				clr=cooler.Cooler(self.name+'::resolutions/'+str(res))
+				self.pyramid[key]=(clr, self.coolerTiles(clr))
+				while len(self.pyramid)>self.maxLevels:
+					self.pyramid.popitem(last=False)
+			self.pyramid.move_to_end(key)
+			return self.pyramid[key]
+
+	def setLevel(self, res): #Auto resolution: switch level, keeping the shift
+		self.clr,self.tiles=self.getLevel(res)
+		self.rawdata=self.sparse=None
+		self.res=res
+		self.size=self.tiles.size
+		self.sizebp=self.size*self.res
+		self.lastBlock=self.prevBlock=None
+
+	def autoLevel(self, bpPerPixel): #Auto resolution: coarsest level still giving a bin per screen pixel, None without levels
+		levels=sorted(int(i) for i in self.resolutions)
+		if not levels:
+			return None
+		fit=[i for i in levels if i<=bpPerPixel]
+		return fit[-1] if fit else levels[0]
+
+	def warmLevels(self): #Auto resolution: read the last block region and value ranges at neighbouring levels
+		levels=sorted(int(i) for i in self.resolutions)
+		k=levels.index(self.res)
+		rows,cols=self.lastBlock
+		for res in levels[max(0, k-1):k+2]:
+			if res!=self.res:
+				clr,tiles=self.getLevel(res)
+				self.getStats((clr, res))
+				ratio=self.lastStride*self.res/res
+				stride=2**int(math.log2(ratio)) if ratio>1 else 1 #as viewChanged would choose there
+				r,c=rows*self.res//res%tiles.size,cols*self.res//res%tiles.size
+				tiles.prefetch(r//stride*stride, c//stride*stride, stride=stride, check=self.step)
+		with self.pyramidLock:
+			if (self.name, self.res) in self.pyramid:
+				self.pyramid.move_to_end((self.name, self.res))
+
 	def close(self):
+		kept={k:getattr(self, k) for k in ('expectedCache', 'statsCache', 'histCache', 'weightCache', 'resolutionCache', 'autoRes')} #survive reopening
+		self.cache.clear()
 		self.__init__()
+		self.__dict__.update(kept)
 
 	def process(self):
-		self.prepdata=self.rawdata
-		if self.oe:
-			self.prepdata=OE(self.prepdata)
+		if self.lazy(): #blocks are processed on request, only global levels are needed
+			self.prepdata=self.codes=None
+			self.valueRange=self.getStats()[:2]
+			if self.sparse is not None:
+				key=('prep', self.mapKey(), self.res, self.balance, self.oe, self.log)
+				self.prepvalues=self.cache.get(key)
+				if self.prepvalues is None:
+					self.prepvalues=self.cache.put(key, self.processSparse())
+			self.histogram()
+			return
+		if self.compare is not None: #maps are combined after O/E
+			self.loadCooler()
+		key=('prep', self.mapKey(), self.res, self.balance, self.oe, self.log)
+		self.prepdata=self.cache.get(key)
+		self.codes=self.cache.get(('codes',)+key[1:])
+		if self.prepdata is not None and self.codes is not None:
+			return
+		if self.prepdata is not None: #codes were evicted
+			self.codes=self.cache.put(('codes',)+key[1:], quantize(self.prepdata))
+			return
+		out=np.empty(self.rawdata.shape, dtype=self.dtype) #every step after the first runs in place on it
+		data=self.rawdata
+		if self.oe and self.compare is None:
+			exp=self.getExpected()
+			self.step('Computing O/E')
+			with profiler.stage('OE'):
+				data=OE(data, exp=exp, out=out)
+		mi,ma=self.valueRange=self.denseRange(data)
+		if self.log:
+			self.step('Log scaling')
+			with profiler.stage('LOG'):
+				if self.compare is not None and self.compareMode=='ratio':
+					data=np.log2(data, out=out)
+					mi=ma=None
+				else:
+					data=LOG(data, mi, ma, out=out)
+					mi,ma=np.log10((ma-mi)/10000), np.log10(ma-mi+(ma-mi)/10000)
+		self.step('Normalizing')
+		with profiler.stage('NORM'):
+			self.prepdata=self.cache.put(key, NORM(data, mi, ma, out=out))
+		self.step('Quantizing')
+		with profiler.stage('quantizing'):
+			self.codes=self.cache.put(('codes',)+key[1:], quantize(self.prepdata))
+		self.histogram()
+
+	def denseRange(self, data): #Dense mode: value range of the observed or o/e map, kept with the other statistics
+		key=(self.mapKey(), self.res, self.balance, self.oe, 'range')
+		if key not in self.statsCache:
+			self.step('Value range')
+			with profiler.stage('value range'):
+				self.statsCache[key]=(np.nanmin(data), np.nanmax(data))
+		return self.statsCache[key]
+
+	def processSparse(self): #Sparse mode: o/e, log scaling and normalization of the stored cells by the global value range, zero cells are processed on display
+		n=self.size
+		exp=self.getExpected() if self.oe else None
+		out=np.empty(len(self.sparse.data), dtype=self.dtype)
+		lo=0
+		self.step('Processing pixels')
+		with profiler.stage('sparse processing'):
+			for i,j,v in self.sparse.chunks():
+				if exp is not None:
+					v=v/exp[(j-i)%n]
+				out[lo:lo+len(v)]=self.scaled(v)
+				lo+=len(v)
+				self.step()
+		return out
+
+	def product(self, rolled=True): #rolled=False gives the processed map as is, to be rolled on display
+		if not rolled:
+			return self.prepdata
+		with profiler.stage('roll'):
+			return np.roll(self.prepdata, self.offset(), axis=(0, 1))
+
+	def block(self, r0, r1, c0, c1, stride=1): #Lazy mode: processed part [r0:r1:stride, c0:c1:stride] of the rolled map
+		n=self.size
+		rows=(np.arange(r0, r1, stride)-self.offset())%n
+		cols=(np.arange(c0, c1, stride)-self.offset())%n
+		if self.sparse is None and stride>1: #zoomed out views are read from sampled tiles
+			rows,cols=rows//stride*stride,cols//stride*stride
+		self.lastBlock,self.prevBlock=(rows, cols),self.lastBlock
+		self.lastStride=stride
+		if self.sparse is not None: #cells are processed already
+			with profiler.stage('block processing'):
+				data=self.sparse.block(rows, cols, self.prepvalues, fill=self.scaled(np.zeros(1))[0])
+				if self.oe: #empty cells have no o/e at distances without contacts, as in the other modes
+					data[self.getExpected()[(cols[None, :]-rows[:, None])%n]==0]=np.nan
+				return data
+		with profiler.stage('cooler I/O'):
+			data=self.tiles.block(rows, cols, stride, check=self.step)
+		with profiler.stage('block processing'):
+			if self.oe:
+				np.divide(data, self.getExpected()[(cols[None, :]-rows[:, None])%n], out=data)
+			return self.scaled(data)
+
+	def band(self, distance=None): #Processed map cells up to a distance (bp) from the diagonal, band[i, d]=map[(i+d)%n, i] of the unrolled map
+		n=self.size
+		d=n//2+1 if distance is None else max(1, min(n//2+1, int(math.ceil(distance/self.res))))
+		key=('band', self.mapKey(), self.res, self.balance, self.oe, self.log, d)
+		band=self.cache.get(key)
+		if band is None:
+			with profiler.stage('band'):
+				band=np.empty((n, d), dtype=self.prepdata.dtype)
+				step=max(1, 2**20//d) #rows per chunk
+				for i0 in range(0, n, step):
+					i=np.arange(i0, min(n, i0+step))[:, None]
+					band[i0:i0+step]=self.prepdata[(i+np.arange(d)[None, :])%n, i]
+			band=self.cache.put(key, band)
+		return band
+
+	def scaled(self, data): #Lazy mode: log scaling and normalization of observed or o/e values by the global value range
+		mi,ma=self.valueRange
 		if self.log:
-			self.prepdata=LOG(self.prepdata)
-		self.prepdata=NORM(self.prepdata)
+			data=LOG(data, mi, ma)
+			mi,ma=np.log10((ma-mi)/10000), np.log10(ma-mi+(ma-mi)/10000)
+		return NORM(data, mi, ma)
 
-	def product(self):
-		step=self.rawdata.shape[0]/100
-		findata=np.roll(self.prepdata, int(self.shift*step), axis=0)
-		findata=np.roll(findata, int(self.shift*step), axis=1)
-		return findata
+	def prefetch(self): #Lazy mode: read tiles ahead of the last block in the direction of panning
+		if self.tiles is None or self.lastBlock is None:
+			return
+		if self.prevBlock is not None:
+			n=self.size
+			ahead=[]
+			for new,old in zip(self.lastBlock, self.prevBlock):
+				d=(new[0]-old[0]+n//2)%n-n//2 #shortest way around the circle
+				ahead.append((new+d)%n)
+			self.tiles.prefetch(*ahead, stride=self.lastStride, check=self.step)
+		if self.autoRes:
+			self.warmLevels()
+
+	def offset(self): #Current shift in bins
+		step=self.size/100
+		return int(self.shift*step)
+
+	def histogram(self): #(histogram, levels) of the processed map from a sample of it, in lazy mode from the sample taken by getStats
+		key=(self.mapKey(), self.res, self.balance, self.oe, self.log)
+		if key not in self.histCache:
+			with profiler.stage('histogram'):
+				self.histCache[key]=histogram(self.scaled(self.getStats()[2]) if self.lazy() else self.prepdata)
+		return self.histCache[key]
+
+	def getExpected(self, level=None): #Expected vector of the current map or given (clr, res), computed once per (file, resolution, balance)
+		clr,res=level or (self.clr, self.res)
+		key=(self.name, res, self.balance)
+		if key not in self.expectedCache:
+			self.step('Computing expected')
+			with profiler.stage('expected'):
+				if level is None and self.sparse is not None:
+					self.expectedCache[key]=scanCells(self.size, len(self.sparse.data), self.sparse.chunks(), masked=np.count_nonzero(self.sparse.masked), check=self.step)[0]
+				elif level is not None or (self.lazy() and clr is not None):
+					self.expectedCache[key]=scanPixels(clr, self.weights(clr), check=self.step)[0]
+				else:
+					self.expectedCache[key]=expected(self.matrix if self.rawdata is None else self.rawdata, check=self.step)
+		return self.expectedCache[key]
+
+	def getStats(self, level=None): #Lazy mode: value range and a sample of the whole (observed or o/e) map
+		clr,res=level or (self.clr, self.res)
+		key=(self.name, res, self.balance, self.oe)
+		if key not in self.statsCache:
+			exp=self.getExpected(level) if self.oe else None
+			self.step('Scanning pixels')
+			if clr is None:
+				self.statsCache[key]=scanMatrix(self.matrix, exp=exp, check=self.step)
+			elif level is None and self.sparse is not None:
+				self.statsCache[key]=scanCells(self.size, len(self.sparse.data), self.sparse.chunks(), exp=exp, masked=np.count_nonzero(self.sparse.masked), check=self.step)[1:]
+			else:
+				self.statsCache[key]=scanPixels(clr, self.weights(clr), exp=exp, check=self.step)[1:]
+		return self.statsCache[key]
 
 	def toggleOE(self):
 		self.oe=not self.oe
@@ -401,17 +1072,209 @@ class hicInterface(): #Convinient envelope for cooler, also processing data and
 		self.log=not self.log
 		self.process()
 
-	def changeShift(self, arg):
-		self.shift+=arg
-		if self.shift>=100:
-			self.shift=0
-		if self.shift<=-100:
-			self.shift=0
+	def changeShift(self, arg): #Shift in % of the genome, any fraction
+		self.shift=math.fmod(self.shift+arg, 100)
 
 	#def summary(self):
 	#	return self.bname, self.sizebp, self.res, self.log, self.oe, int(self.shift*self.sizebp/100)
 
 
+class MatrixCache(): #LRU store of arrays bounded by their total size in bytes, shared by threads
+
+	def __init__(self, budget):
+		self.budget=budget
+		self.items=OrderedDict()
+		self.nbytes=0
+		self.lock=threading.RLock()
+		self.held=[] #arrays of the shown map, in use whether cached or not
+
+	def get(self, key):
+		with self.lock:
+			if key not in self.items:
+				return None
+			self.items.move_to_end(key)
+			return self.items[key]
+
+	def put(self, key, value): #Returns the value, cached or not
+		with self.lock:
+			self.pop(key)
+			if value.nbytes<=self.budget:
+				self.items[key]=value
+				self.nbytes+=value.nbytes
+				self.reserve(0)
+			return value
+
+	def reserve(self, nbytes): #Evict least recently used arrays, except the held ones, until nbytes more fit next to the held arrays
+		with self.lock:
+			cached={id(v) for v in self.items.values()}
+			held={id(v) for v in self.held}
+			outside=sum(v.nbytes for v in self.held if id(v) not in cached)
+			for key in [k for k,v in self.items.items() if id(v) not in held]:
+				if self.nbytes+outside+nbytes<=self.budget:
+					break
+				self.pop(key)
+
+	def hold(self, arrays):
+		with self.lock:
+			self.held=[v for v in arrays if v is not None]
+			self.reserve(0)
+
+	def pop(self, key):
+		with self.lock:
+			if key in self.items:
+				self.nbytes-=self.items.pop(key).nbytes
+
+	def clear(self):
+		with self.lock:
+			self.items.clear()
+			self.nbytes=0
+			self.held=[]
+
+
+class WeightedMatrix(): #Matrix selector of a cooler balanced by given weights, sliced as clr.matrix()
+
+	def __init__(self, clr, weights):
+		self.matrix=clr.matrix(balance=False)
+		self.weights=weights
+
+	def __getitem__(self, key):
+		rows,cols=key
+		return self.matrix[rows, cols]*self.weights[rows][:, None]*self.weights[cols][None, :]
+
+
+class TileCache(): #Bounded LRU store of square tiles of a big map, read on demand, shared by threads
+
+	def __init__(self, fetch, size, tile=512, maxTiles=64, sampled=None, maxStrides=3):
+		self.fetch=fetch #fetch(r0, r1, c0, c1) returns dense part of the map
+		self.size=size
+		self.tile=tile
+		self.maxTiles=maxTiles
+		self.tiles=OrderedDict()
+		self.sampled=sampled #sampled(stride) returns fetch of every stride-th bin, zoomed out views are read from it
+		self.strides=OrderedDict() #TileCaches of sampled bins per stride
+		self.maxStrides=maxStrides
+		self.inUse=0 #tiles needed by the last block
+		self.lock=threading.RLock() #held while a tile is read, files are read by one thread at a time anyway
+
+	def cached(self, ti, tj):
+		with self.lock:
+			return (ti,tj) in self.tiles or (tj,ti) in self.tiles
+
+	def get(self, ti, tj):
+		with self.lock:
+			if (ti,tj) in self.tiles:
+				self.tiles.move_to_end((ti,tj))
+				return self.tiles[(ti,tj)]
+			if (tj,ti) in self.tiles: #map is symmetric
+				self.tiles.move_to_end((tj,ti))
+				return self.tiles[(tj,ti)].T
+			t=self.tile
+			data=np.asarray(self.fetch(ti*t, min((ti+1)*t, self.size), tj*t, min((tj+1)*t, self.size)), dtype=float)
+			self.tiles[(ti,tj)]=data
+			while len(self.tiles)>self.maxTiles:
+				self.tiles.popitem(last=False)
+			return data
+
+	def strided(self, stride): #TileCache of every stride-th bin, itself if there is no such source
+		if stride==1 or self.sampled is None:
+			return self
+		with self.lock:
+			if stride not in self.strides:
+				self.strides[stride]=TileCache(self.sampled(stride), -(-self.size//stride), self.tile, self.maxTiles)
+				while len(self.strides)>self.maxStrides:
+					self.strides.popitem(last=False)
+			self.strides.move_to_end(stride)
+			return self.strides[stride]
+
+	def block(self, rows, cols, stride=1, check=None): #Dense block for arbitrary (e.g. wrapped) bin indices, multiples of stride
+		cache=self.strided(stride)
+		if cache is not self:
+			return cache.block(rows//stride, cols//stride, check=check)
+		out=np.empty((len(rows), len(cols)))
+		rt,ct=rows//self.tile, cols//self.tile
+		urt,uct=np.unique(rt), np.unique(ct)
+		self.inUse=len(urt)*len(uct)
+		for ti in urt:
+			rsel=rt==ti
+			for tj in uct:
+				if check is not None:
+					check()
+				csel=ct==tj
+				out[np.ix_(rsel, csel)]=self.get(ti, tj)[np.ix_(rows[rsel]%self.tile, cols[csel]%self.tile)]
+		return out
+
+	def prefetch(self, rows, cols, stride=1, check=None): #Read tiles for given bins, not pushing out the ones in use
+		cache=self.strided(stride)
+		if cache is not self:
+			return cache.prefetch(rows//stride, cols//stride, check=check)
+		room=self.maxTiles-self.inUse
+		for ti in np.unique(rows//self.tile):
+			for tj in np.unique(cols//self.tile):
+				if room<=0:
+					return
+				if check is not None:
+					check()
+				if not self.cached(ti, tj):
+					self.get(ti, tj)
+					room-=1
+
+
+class SparseMatrix(): #Symmetric map kept as the nonzero cells of its upper half in CSR form, as cooler stores pixels; other cells are zeros
+
+	def __init__(self, indptr, indices, data, masked=None):
+		self.indptr=indptr #offsets of the rows in indices and data, n+1
+		self.indices=indices #columns
+		self.data=data #values, NaN for bins without balancing weights
+		self.size=len(indptr)-1
+		self.masked=np.zeros(self.size, dtype=bool) if masked is None else masked #bins without balancing weights, NaN in all their cells
+
+	@property
+	def nbytes(self):
+		return self.indptr.nbytes+self.indices.nbytes+self.data.nbytes+self.masked.nbytes
+
+	@classmethod
+	def fromCooler(cls, clr, weights=None, dtype=np.float64, chunk=2**22, check=None): #Pixel table read by chunks, counts multiplied by the weights
+		n,nnz=clr.shape[0],clr.info['nnz']
+		counts=np.zeros(n, dtype=np.int64)
+		indices=np.empty(nnz, dtype=np.int32)
+		data=np.empty(nnz, dtype=dtype)
+		pixels=clr.pixels()
+		for lo in range(0, nnz, chunk):
+			p=pixels[lo:lo+chunk]
+			i,j=p['bin1_id'].values, p['bin2_id'].values
+			counts+=np.bincount(i, minlength=n)
+			indices[lo:lo+len(j)]=j
+			data[lo:lo+len(j)]=p['count'].values if weights is None else p['count'].values*weights[i]*weights[j]
+			if check is not None:
+				check()
+		return cls(np.concatenate(([0], np.cumsum(counts))), indices, data, None if weights is None else np.isnan(weights))
+
+	def chunks(self, chunk=2**22): #(rows, columns, values) of the stored cells by chunks
+		for lo in range(0, len(self.data), chunk):
+			hi=min(len(self.data), lo+chunk)
+			yield np.searchsorted(self.indptr, np.arange(lo, hi), side='right')-1, self.indices[lo:hi], self.data[lo:hi]
+
+	def block(self, rows, cols, values=None, fill=0): #Dense block for arbitrary (e.g. wrapped) bin indices; values of the stored cells (e.g. processed) may be given, other cells are fill
+		values=self.data if values is None else values
+		out=np.full((len(rows), len(cols)), fill, dtype=values.dtype)
+		pos=np.empty(self.size, dtype=np.int64)
+		for a,b,lower in ((rows, cols, False), (cols, rows, True)): #the lower half is the upper one transposed
+			pos.fill(-1)
+			pos[b]=np.arange(len(b))
+			starts,lengths=self.indptr[a],self.indptr[a+1]-self.indptr[a]
+			entries=np.repeat(starts-np.cumsum(lengths)+lengths, lengths)+np.arange(lengths.sum())
+			k=pos[self.indices[entries]]
+			hit=k>=0
+			r,k,entries=np.repeat(np.arange(len(a)), lengths)[hit],k[hit],entries[hit]
+			if lower:
+				out[k, r]=values[entries]
+			else:
+				out[r, k]=values[entries]
+		out[self.masked[rows]]=np.nan
+		out[:, self.masked[cols]]=np.nan
+		return out
+
+
 class Track(pg.PlotItem): #Track for showing features
 	
 	def __init__(self, name, curve=False):
@@ -443,85 +1306,390 @@ class Track(pg.PlotItem): #Track for showing features
 			self.setMouseEnabled(x=True,y=False)
 
 
-regionColors=pg.colormap.get('CET-R4')
-class Region(pg.PlotCurveItem): #Genes and regions on tracks
+class IntervalIndex(): #Intervals grouped by length (powers of four), each group sorted by start, so that a few long ones do not widen every search
 
-	def __init__(self, x, mapsize, direction='0', nameOfReg=''):
+	def __init__(self, starts, ends):
+		self.starts=starts
+		lengths=np.maximum(ends-starts, 1)
+		classes=np.ceil(np.log2(lengths)/2).astype(int) #lengths within a group differ up to 4 times
+		self.groups=[] #(indices sorted by start, their starts, ends, longest length)
+		for c in np.unique(classes):
+			idx=np.nonzero(classes==c)[0]
+			idx=idx[np.argsort(starts[idx], kind='stable')]
+			self.groups.append((idx, starts[idx], ends[idx], lengths[idx].max()))
 
-		if '+' in direction:
-			pen=pg.mkPen(regionColors.map(uniform(0.78,1)), width=12*dpr)
-			y=[1,1]
-		elif '-' in direction:
-			pen=pg.mkPen(regionColors.map(uniform(0.1,0.35)), width=12*dpr)
-			y=[-1,-1]
-		else:
-			pen=pg.mkPen(regionColors.map(uniform(0.375,0.60)), width=12*dpr)
-			y=[0,0]
-		
-		super().__init__(x=np.array(x)%mapsize if mapsize!=0 else x, 
-			y=y, pen=pen, clickable=True, skipFiniteCheck=True)
+	def overlapping(self, x0, x1): #Indices of intervals overlapping [x0, x1], by start
+		found=[]
+		for idx,starts,ends,longest in self.groups:
+			lo=np.searchsorted(starts, x0-longest, side='left') #all before lo end before x0
+			hi=np.searchsorted(starts, x1, side='right') #all from hi start after x1
+			found.append(idx[lo+np.nonzero(ends[lo:hi]>=x0)[0]])
+		if not found:
+			return np.zeros(0, dtype=int)
+		found=np.concatenate(found)
+		return found[np.lexsort((found, self.starts[found]))]
 
-		if self.xData[0]>self.xData[1]:
-			self.setPen(None)
-		
-		self.nameOfReg=nameOfReg
-		#self.direction=direction
-		self.setClickable(True, width=15*dpr)
-		self.sigClicked.connect(self.lineClicked)
-		self.mapsize=mapsize
-		self.pen=pen
-		self.setCursor(Qt.PointingHandCursor)
 
-	def mov(self, arg):
-		self.setData(x=(self.xData+arg)%self.mapsize, y=self.yData)
-		if self.xData[0]>self.xData[1]:
-			self.setPen(None)
-		else:
-			self.setPen(self.pen)
+class Features(pg.GraphicsObject): #Genes and regions on tracks, drawn as one batched path per strand and color
+
+	strandRows={'+':1, '-':-1} #y of the strand, other features are drawn at 0
+	strandColors={1:(0.78,1), -1:(0.1,0.35), 0:(0.375,0.60)} #ranges of regionColors
+	shades=4 #colors per strand
+
+	def __init__(self, starts, ends, names, strands, mapsize, shift=0, feed=None):
+		super().__init__()
+		regionColors=pg.colormap.get('CET-R4')
+		self.pens={(row,k):pg.mkPen(regionColors.map(lo+(hi-lo)*(k+0.5)/self.shades), width=12*dpr) 
+			for row,(lo,hi) in self.strandColors.items() for k in range(self.shades)}
+		self.mapsize=mapsize
+		self.shift=shift
+		self.feed=feed
+		self.setAcceptHoverEvents(True)
+		self.setFeatures(starts, ends, names, strands)
+
+	def setFeatures(self, starts, ends, names, strands):
+		self.starts=np.atleast_1d(np.asarray(starts, dtype=float))
+		self.ends=np.atleast_1d(np.asarray(ends, dtype=float))
+		self.names=np.atleast_1d(np.asarray(names, dtype=object))
+		self.rows=np.array([self.strandRows.get(i.strip(), 0) for i in np.atleast_1d(strands)], dtype=int)
+		self.shade=(self.starts.astype(np.int64)*2654435761>>7)%self.shades #same color whenever a feature is refetched
+		self.layout()
+
+	def setRecords(self, fmt, cols):
+		self.setFeatures(*featureArrays(fmt, cols))
+
+	def layout(self): #Index features once in genome coordinates, the ones wrapping around the origin split in two; shifts only rotate queries
+		L=self.mapsize
+		if L!=0:
+			self.shift%=L
+		x0,x1=(self.starts%L,self.ends%L) if L!=0 else (self.starts,self.ends)
+		wrap=np.nonzero(x0>x1)[0]
+		self.segIndex=np.concatenate((np.arange(len(x0)), wrap)) #feature of each segment
+		self.segStarts=np.concatenate((x0, np.zeros(len(wrap))))
+		self.segEnds=np.concatenate((np.where(x0>x1, L, x1), x1[wrap]))
+		self.index=IntervalIndex(self.segStarts, self.segEnds)
+		self.pathRange=None
+		self.prepareGeometryChange()
+		self.update()
+
+	def segments(self, x0, x1): #(features, starts, ends) of segments on screen overlapping [x0, x1] at the current shift, by start; the ones crossing the origin there are split
+		L,shift=self.mapsize,self.shift
+		if L==0:
+			seg=self.index.overlapping(x0-shift, x1-shift)
+			return self.segIndex[seg],self.segStarts[seg]+shift,self.segEnds[seg]+shift
+		x0,x1=max(x0, 0),min(x1, L)
+		if x0>x1:
+			return np.zeros(0, dtype=int),np.zeros(0),np.zeros(0)
+		g0,g1=x0-shift,x1-shift #genome window, shift is within [0, L)
+		windows=[(g0+L, g1+L)] if g1<0 else [(g0+L, L), (0, g1)] if g0<0 else [(g0, g1)]
+		seg=np.unique(np.concatenate([self.index.overlapping(a, b) for a,b in windows]))
+		starts,ends=self.segStarts[seg]+shift,self.segEnds[seg]+shift
+		past=starts>=L
+		starts[past]-=L
+		ends[past]-=L
+		cross=np.nonzero(ends>L)[0] #drawn as [start, L] and [0, end-L]
+		features=np.concatenate((self.segIndex[seg], self.segIndex[seg[cross]]))
+		starts=np.concatenate((starts, np.zeros(len(cross))))
+		ends=np.concatenate((np.minimum(ends, L), ends[cross]-L))
+		keep=np.nonzero((ends>=x0)&(starts<=x1))[0] #a piece of a split one may be elsewhere
+		order=keep[np.lexsort((features[keep], starts[keep]))]
+		return features[order],starts[order],ends[order]
+
+	def buildPaths(self, x0, x1): #Paths of segments overlapping [x0, x1] only
+		features,starts,ends=self.segments(x0, x1)
+		rows,shade=self.rows[features],self.shade[features]
+		self.paths=[]
+		for (row,k),pen in self.pens.items():
+			sel=(rows==row)&(shade==k)
+			if sel.any():
+				x=np.column_stack((starts[sel], ends[sel])).ravel()
+				self.paths.append((pen, pg.arrayToQPath(x, np.full(len(x), row), connect='pairs')))
+		self.pathRange=(x0, x1)
+
+	def mov(self, arg): #Rotate the drawn features, the index stays as is
+		self.shift+=arg
+		if self.mapsize!=0:
+			self.shift%=self.mapsize
+		self.pathRange=None
+		self.prepareGeometryChange()
+		self.update()
+		self.viewRangeChanged()
 
 	def siz(self, arg):
 		self.mapsize=arg
+		self.layout()
+		self.viewRangeChanged()
+
+	def viewRangeChanged(self, *args):
+		if self.feed is not None:
+			self.feed.update(self)
+
+	def dataBounds(self, ax, frac=1.0, orthoRange=None):
+		if ax==0 and self.feed is not None:
+			return (0, self.mapsize or self.feed.source.extent())
+		if len(self.segStarts)==0:
+			return (None, None)
+		if ax==0:
+			L,starts,ends=self.mapsize,self.segStarts+self.shift,self.segEnds+self.shift
+			if L==0:
+				return (starts.min(), ends.max())
+			past=starts>=L
+			starts[past]-=L
+			ends[past]-=L
+			if (ends>L).any(): #a segment crosses the origin on screen
+				return (0, L)
+			return (starts.min(), ends.max())
+		return (-1, 1)
+
+	def pixelPadding(self):
+		return 6*dpr
+
+	def boundingRect(self):
+		if len(self.segStarts)==0:
+			return QtCore.QRectF()
+		pw,ph=self.pixelWidth()*self.pixelPadding(),self.pixelHeight()*self.pixelPadding()
+		x0,x1=self.dataBounds(0)
+		return QtCore.QRectF(x0-pw, -1-ph, x1-x0+2*pw, 2+2*ph)
+
+	def viewTransformChanged(self): #pixel padding changes with zoom
+		self.prepareGeometryChange()
+
+	def paint(self, painter, *args): #Only features in view are drawn, paths are reused while panning within a margin
+		vr=self.viewRect()
+		if vr is None:
+			return
+		pad=self.pixelWidth()*self.pixelPadding()
+		x0,x1=vr.left()-pad,vr.right()+pad
+		if self.pathRange is None or x0<self.pathRange[0] or x1>self.pathRange[1]:
+			self.buildPaths(x0-(x1-x0)/2, x1+(x1-x0)/2)
+		for pen,path in self.paths:
+			painter.setPen(pen)
+			painter.drawPath(path)
+
+	def featureAt(self, pos): #Index of the feature under a point in item coordinates, None if there is none
+		tx,ty=7.5*dpr*self.pixelWidth(),7.5*dpr*self.pixelHeight()
+		features=self.segments(pos.x()-tx, pos.x()+tx)[0]
+		hit=features[np.abs(self.rows[features]-pos.y())<=ty]
+		return hit[0] if len(hit) else None
+
+	def hoverEvent(self, ev):
+		if not ev.isExit() and self.featureAt(ev.pos()) is not None:
+			self.setCursor(Qt.PointingHandCursor)
+		else:
+			self.unsetCursor()
 
-	def lineClicked(self):
+	def mouseClickEvent(self, ev):
+		if ev.button()!=Qt.LeftButton:
+			return
+		i=self.featureAt(ev.pos())
+		if i is None:
+			return
+		ev.accept()
 		msg = QtWidgets.QMessageBox()
-		msg.setText(self.nameOfReg.replace(';','\n'))
-		#msg.setInformativeText(str(self.xData))
+		msg.setText(str(self.names[i]).replace(';','\n'))
 		msg.setWindowTitle("Feature info")
 		msg.exec_()
 
 
-class Curve(pg.PlotCurveItem): #bedgraph curves on tracks
-#Переписываем curveData под array
-	def __init__(self, curveData, pen, mapsize):
+class Curve(pg.PlotCurveItem): #bedgraph curves on tracks, kept in genome order and decimated to the view
+
+	minBlocks=256 #coarsest decimation level size
+
+	def __init__(self, curveData, pen, mapsize, shift=0, feed=None):
 		self.mapsize=mapsize
 		self.pen=pen
-		self.curveData=curveData
-		self.rearrange(self.curveData)
+		self.shift=shift
+		self.feed=feed
 		self.log=False
-
-		super().__init__(x=self.curveData['x'], y=self.curveData['y'], pen=pen, skipFiniteCheck=True)
-		
-	def rearrange(self, inpList):
+		self.rawX=np.asarray(curveData['x'], dtype=float)
+		self.rawY=np.asarray(curveData['y'], dtype=float)
+		super().__init__(pen=pen, skipFiniteCheck=True)
+		self.arrange()
+
+	def setRecords(self, fmt, cols):
+		data=curveData(cols)
+		self.rawX=np.asarray(data['x'], dtype=float)
+		self.rawY=np.asarray(data['y'], dtype=float)
+		self.arrange()
+
+	def arrange(self): #Sort once into genome order and build the min/max pyramid, rotation never reorders
 		if self.mapsize!=0:
-			inpList['x']%=self.mapsize
-		inpList.sort(order='x')
+			self.shift%=self.mapsize
+		x=self.rawX%self.mapsize if self.mapsize!=0 else self.rawX
+		order=np.argsort(x, kind='stable')
+		x,y=x[order],self.rawY[order]
+		self.mi,self.ma=(np.nanmin(y),np.nanmax(y)) if len(y) else (0,0)
+		self.pyramid=[(x,y,y)] #level j: block positions, minima and maxima of 2**j points
+		while len(x)>self.minBlocks:
+			x,lo,hi=self.pyramid[-1]
+			starts=np.arange(0, len(x), 2)
+			x=(x[starts]+x[np.minimum(starts+1, len(x)-1)])/2
+			self.pyramid.append((x, np.fmin.reduceat(lo, starts), np.fmax.reduceat(hi, starts)))
+		self.drawn=None
+		self.redraw()
+
+	def visible(self, x, v0, v1): #Index ranges of sorted genome positions x shown within [v0, v1] at the current shift
+		L,n=self.mapsize,len(x) #one neighbour on each side keeps the line running to the view edges
+		if L==0:
+			return [(max(0, np.searchsorted(x, v0-self.shift)-1), min(n, np.searchsorted(x, v1-self.shift, side='right')+1))]
+		k=np.searchsorted(x, L-self.shift) #x[k:] come first on screen, x[:k] follow
+		return [(max(k, np.searchsorted(x, v0-self.shift+L)-1), min(n, np.searchsorted(x, v1-self.shift+L, side='right')+1)),
+			(max(0, np.searchsorted(x, v0-self.shift)-1), min(k, np.searchsorted(x, v1-self.shift, side='right')+1))]
+
+	def redraw(self): #Send about one point pair per screen pixel of the view, with a margin reused while panning
+		vb=self.getViewBox()
+		if vb is None or vb.width()<=0:
+			v0,v1=self.dataBounds(0)
+			v0,v1,pixels=v0 or 0,v1 or 0,1000
+		else:
+			(v0,v1),_=vb.viewRange()
+			pixels=vb.width()*dpr
+		x=self.pyramid[0][0]
+		count=sum(j-i for i,j in self.visible(x, v0, v1))
+		level=min(len(self.pyramid)-1, max(0, math.ceil(math.log2(max(count, 1)/pixels))))
+		if self.drawn is not None and self.drawn[2]==level and self.drawn[0]<=v0 and v1<=self.drawn[1]:
+			return
+		m=(v1-v0)/2
+		x,lo,hi=self.pyramid[level]
+		xs,ys=[],[]
+		for i,j in self.visible(x, v0-m, v1+m):
+			if i>=j:
+				continue
+			pos=x[i:j]+self.shift
+			if self.mapsize!=0:
+				pos%=self.mapsize
+			if level==0:
+				xs.append(pos)
+				ys.append(lo[i:j])
+			else:
+				xs.append(np.repeat(pos, 2))
+				ys.append(np.column_stack((lo[i:j], hi[i:j])).ravel())
+		xs=np.concatenate(xs) if xs else np.zeros(0)
+		ys=np.concatenate(ys) if ys else np.zeros(0)
+		if self.log:
+			ys=LOG(ys, self.mi, self.ma)
+		self.drawn=(v0-m, v1+m, level)
+		self.setData(x=xs, y=ys)
+
+	def viewRangeChanged(self, *args):
+		if self.feed is not None:
+			self.feed.update(self)
+		self.redraw()
+
+	def dataBounds(self, ax, frac=1.0, orthoRange=None): #Whole track unless bounds of the visible part are asked
+		if orthoRange is not None:
+			return super().dataBounds(ax, frac, orthoRange)
+		if ax==0 and self.feed is not None:
+			return (0, self.mapsize or self.feed.source.extent())
+		if len(self.rawX)==0:
+			return (None, None)
+		if ax==0:
+			x=self.pyramid[0][0]
+			return (0, self.mapsize) if self.mapsize!=0 else (x[0], x[-1])
+		if self.log:
+			return tuple(LOG(np.array([self.mi, self.ma]), self.mi, self.ma))
+		return (self.mi, self.ma)
 
 	def toggleLOG(self):
-		if self.log==False:
-			self.mi=np.nanmin(self.curveData['y'])
-			self.curveData['y']=LOG(self.curveData['y'])
-		else:
-			self.curveData['y']=self.mi+10**self.curveData['y']
-		self.setData(x=self.curveData['x'], y=self.curveData['y'])
 		self.log=not self.log
+		self.drawn=None
+		self.redraw()
 
 	def mov(self, arg):
-		self.curveData['x']+=arg
-		self.rearrange(self.curveData)
-		self.setData(x=self.curveData['x'], y=self.curveData['y'])
+		self.shift+=arg
+		if self.mapsize!=0:
+			self.shift%=self.mapsize
+		self.drawn=None
+		self.viewRangeChanged()
 
 	def siz(self, arg):
 		self.mapsize=arg
+		self.arrange()
+		self.viewRangeChanged()
+
+
+class TabixFeed(): #Records of a tabix-indexed track around the view, refetched once the view leaves the fetched part
+
+	def __init__(self, fname):
+		self.source=TabixTrack(fname)
+		self.fetched=[]
+
+	def update(self, item):
+		vb=item.getViewBox()
+		if vb is None:
+			return
+		(v0,v1),_=vb.viewRange()
+		m=(v1-v0)/2
+		if (all(any(a<=g0 and g1<=b for a,b in self.fetched) for g0,g1 in genomeRanges(v0, v1, item.shift, item.mapsize))
+				and sum(b-a for a,b in self.fetched)<=4*(v1-v0+2*m)): #zooming in far enough drops the rest
+			return
+		self.fetched=genomeRanges(v0-m, v1+m, item.shift, item.mapsize)
+		parts=[self.source.query(g0, g1) for g0,g1 in self.fetched]
+		item.setRecords(self.source.fmt, {k:np.concatenate([p[k] for p in parts]) for k in parts[0]})
+
+
+def genomeRanges(v0, v1, shift, mapsize): #Genome intervals shown within [v0, v1] of a track rolled by shift
+	if mapsize==0:
+		return [(v0-shift, v1-shift)]
+	if v1-v0>=mapsize:
+		return [(0, mapsize)]
+	g0=(v0-shift)%mapsize
+	g1=g0+v1-v0
+	return [(g0, g1)] if g1<=mapsize else [(g0, mapsize), (0, g1-mapsize)]
+
+
+def featureArrays(fmt, cols): #Starts, ends, names and strands of BED/GFF columns
+	if fmt=='bed':
+		return cols['starts'],cols['ends'],cols['names'],np.full(len(cols['starts']), '0')
+	starts,ends,strand=cols['starts'],cols['ends'],cols['strands']
+	names=np.char.add(np.char.add(cols['types'], '\n'), cols['attributes']).astype(object)
+	first=np.flatnonzero(np.r_[True, starts[1:]!=starts[:-1]][:len(starts)]) #features sharing a start are merged
+	for i,j in zip(first, np.r_[first[1:], len(starts)]):
+		if j-i>1:
+			names[i]='\n\n'.join(names[i:j])
+	return starts[first],ends[first],names[first],strand[first]
+
+
+def curveData(cols): #bedGraph points at interval midpoints
+	data=np.zeros(len(cols['starts']), dtype=[('x', 'f'), ('y', 'f')])
+	data['x'],data['y']=(cols['starts']+cols['ends'])/2,cols['values']
+	return data
+
+class Cancelled(Exception):
+	pass
+
+
+class TaskSignals(QtCore.QObject): #Emitted from a worker thread, delivered to the GUI thread by the event loop
+	progress=pyqtSignal(str)
+	finished=pyqtSignal(object)
+	failed=pyqtSignal(str)
+	cancelled=pyqtSignal()
+
+
+class Task(QtCore.QRunnable): #Job for the thread pool, job(check) should call check(stage) between stages
+
+	def __init__(self, job, superseded):
+		super().__init__()
+		self.job=job
+		self.superseded=superseded
+		self.signals=TaskSignals()
+
+	def check(self, stage=None):
+		if self.superseded():
+			raise Cancelled()
+		if stage is not None:
+			self.signals.progress.emit(stage)
+
+	def run(self):
+		try:
+			result=self.job(self.check)
+		except Cancelled:
+			self.signals.cancelled.emit()
+		except Exception as e:
+			self.signals.failed.emit('{}: {}'.format(type(e).__name__, e))
+		else:
+			self.signals.finished.emit(result)
+
 
 class Button(pg.LabelItem): #Control button (clickable label calling a function)
 
@@ -600,6 +1768,8 @@ class CloseButton(pg.LabelItem): #Clickable label, closing one track
 			for i in self.linkedTrack.getViewBox().allChildren()[1:]:
 				self.parentW.sizeChanged.disconnect(i.siz)
 				self.parentW.shiftChanged.disconnect(i.mov)	
+				if i.feed is not None:
+					i.feed.source.close()
 				del i		
 			del self.linkedTrack
 			self.parentL.removeItem(self)
@@ -610,8 +1780,8 @@ class Board(pg.LabelItem): #Label with map info
 
 	def __init__(self, text=''):
 		super().__init__(text=text)
-		self.data={'bname':'', 'sizebp':0, 'res':0, 'log':True, 'oe':False, 
-			'shift':0, 'colormap':'magma', 'closed':True}
+		self.data={'bname':'', 'compare':'', 'mode':'ratio', 'sizebp':0, 'res':0, 'log':True, 'oe':False, 
+			'shift':0, 'colormap':'magma', 'closed':True, 'autores':False, 'status':'', 'timing':[]}
 
 	def update(self, **kwargs):
 		for i in kwargs.keys():
@@ -619,11 +1789,14 @@ class Board(pg.LabelItem): #Label with map info
 				if i==j:
 					self.data[j]=kwargs[i]
 		if self.data['closed']:
-			self.setText('<p style="font-family: '+monoFont+'">No map is opened</p>', color=makeLUT(self.data['colormap'])[128])
+			self.setText('<p style="font-family: '+monoFont+'">No map is opened'+self.status()+self.timing()+'</p>', color=makeLUT(self.data['colormap'])[128])
 		else:
 			if 'bname' in kwargs.keys():
 				if len(self.data['bname'])>18:
 					self.data['bname']=self.data['bname'][0:15]+'...'
+			if kwargs.get('compare'):
+				if len(self.data['compare'])>18:
+					self.data['compare']=self.data['compare'][0:15]+'...'
 			if 'sizebp' in kwargs.keys():
 				sizebp=''
 				for i in range(1,len(str(self.data['sizebp']))+1):
@@ -633,22 +1806,142 @@ class Board(pg.LabelItem): #Label with map info
 				if str(self.data['res'])[-3:]=='000':
 					self.data['res']=str(self.data['res'])[0:-3]+'k' 
 			
-			self.setText('<p style="font-family: '+monoFont+'">{bname}<br>Size {sizebp} bp<br>Resolution {res} bp<br>LOG={log}<br>OE={oe}<br>Shift={shift}<br>Colormap: {colormap}</p>'.format(**self.data), color=makeLUT(self.data['colormap'])[128])
+			self.setText('<p style="font-family: '+monoFont+'">{bname}{versus}<br>Size {sizebp} bp<br>Resolution {res} bp{auto}<br>LOG={log}<br>OE={oe}<br>Shift={shift}<br>Colormap: {colormap}{progress}{breakdown}</p>'.format(auto=' (auto)' if self.data['autores'] else '',
+				versus='<br>{} vs<br>{}'.format('log2 ratio' if self.data['mode']=='ratio' and self.data['log'] else self.data['mode'], self.data['compare']) if self.data['compare'] else '', progress=self.status(), breakdown=self.timing(), **self.data), color=makeLUT(self.data['colormap'])[128])
 
 
-class MyImageItem(pg.ImageItem): #allows to scale and rotate easily
+	def status(self): #Progress of a running request
+		return '<br><br>'+self.data['status']+'...<br>(Esc to cancel)' if self.data['status'] else ''
+
+	def timing(self): #Profiling: the last action and its slowest stages
+		if not self.data['timing']:
+			return ''
+		lines=['{:<13.13}{:>5.0f} ms'.format(name, ms) for name,ms in self.data['timing'][:8]]
+		return '<br><br>'+'<br>'.join(lines).replace(' ', '&nbsp;')
+
+
+class MyImageItem(pg.ImageItem): #allows to scale, rotate and roll easily
 
 	def __init__(self):
 		super().__init__()
 		self.baseScale=1
 		self.tilted=False
+		self.roll=0
+		self.origin=(0,0) #bin of the first pixel, stride bins per pixel and whole map size in lazy mode
+		self.stride=1
+		self.mapBins=None
+		self.band=False #image is a band of diagonals from hicInterface.band(), sheared into the triangle
+		self.codes=None #image quantized by quantize(), drawn instead of it
+		self.indexed=None #(levels, color indices of the codes), the data of qimage
+		self.colors=None #(lut, color table)
+
+	def setBlock(self, block, origin=(0,0), stride=1, mapBins=None, codes=None, band=False): #Show the whole map, its part or its band, codes of it may be given
+		self.origin,self.stride,self.mapBins,self.band=origin,stride,mapBins,band
+		if mapBins is not None: #blocks of a map read by parts are rolled already
+			self.roll=0
+		self.codes=quantize(block) if codes is None else codes
+		self.indexed=None
+		self.setImage(block)
+		self.setScale(self.baseScale)
+
+	def clear(self):
+		self.origin,self.stride,self.mapBins,self.roll,self.band=(0,0),1,None,0,False
+		self.codes=self.indexed=None
+		super().clear()
+
+	def rescale(self, res, mapBins): #Keep the shown block in place on another level of the map, until a block of it is set
+		k=self.baseScale/res #old bins per new one
+		self.origin,self.stride,self.mapBins=(self.origin[0]*k, self.origin[1]*k),self.stride*k,mapBins
+		self.setScale(res)
+
+	def setMap(self, mapBins): #Blank map read by parts, until its first block is set
+		self.clear()
+		self.mapBins=mapBins
+		self.setScale(self.baseScale)
+
+	def covers(self, r0, r1, c0, c1, stride): #Does the current block contain these bins at this stride
+		if self.image is None or self.mapBins is None or stride!=self.stride:
+			return False
+		h,w=self.image.shape[:2]
+		return (self.origin[0]<=r0 and r1<=min(self.mapBins, self.origin[0]+h*stride) and 
+			self.origin[1]<=c0 and c1<=min(self.mapBins, self.origin[1]+w*stride))
+
+	def binRect(self, rect): #Map bins (r0, r1, c0, c1) under a rect in view coordinates
+		r=self.mapRectFromView(rect)
+		return (self.origin[0]+r.left()*self.stride, self.origin[0]+r.right()*self.stride, 
+			self.origin[1]+r.top()*self.stride, self.origin[1]+r.bottom()*self.stride)
+
+	def boundingRect(self): #Whole map even if only a part is loaded
+		if self.band and self.image is not None:
+			w,h=self.image.shape[:2]
+			return QtCore.QRectF(-h/2, 0, w+h/2, h)
+		if self.mapBins is None:
+			return super().boundingRect()
+		s=self.stride
+		return QtCore.QRectF(-self.origin[0]/s, -self.origin[1]/s, self.mapBins/s, self.mapBins/s)
+
+	def setRoll(self, bins): #Roll the genome on display only, the image is neither copied nor rerendered
+		self.roll=bins
+		self.update()
+
+	def render(self): #Levels and LUT applied to the image codes; new levels or LUT only remap the codes
+		with profiler.stage('LUT conversion', notify=False):
+			if self.codes is None or self.levels is None or self.lut is None or np.ndim(self.levels)!=1:
+				return super().render()
+			levels,lut=tuple(self.levels),self.lut
+			if self.indexed is None or self.indexed[0]!=levels:
+				self.indexed=(levels, levelIndex(levels)[self.codes.T]) #codes are column-major, as the image
+			if self.colors is None or self.colors[0] is not lut:
+				self.colors=(lut, colorTable(lut))
+			self.qimage=pg.functions.ndarray_to_qimage(self.indexed[1], QtGui.QImage.Format.Format_Indexed8)
+			self.qimage.setColorTable(self.colors[1])
+			self._renderRequired=False
+			self._unrenderable=False
+
+	def paint(self, painter, *args):
+		with profiler.stage('paint', notify=False):
+			self.paintRolled(painter, *args)
+
+	def paintRolled(self, painter, *args): #Draw the image as up to four pieces swapped around the roll point
+		if self.image is None:
+			return
+		w,h=self.image.shape[:2]
+		s=self.roll%w if w==h or self.band else 0
+		if s==0 and not self.band:
+			return pg.ImageItem.paint(self, painter, *args)
+		if self._renderRequired:
+			self.render()
+			if self._unrenderable:
+				return
+		if self.paintMode is not None:
+			painter.setCompositionMode(self.paintMode)
+		if self.band: #sheared band: genome from 0 to w along the diagonal, cells wrapped around its start drawn too
+			painter.setClipPath(self.bandShape(), Qt.IntersectClip)
+			for u0,u1,x0 in ((0, w-s, s), (w-s, w, 0)):
+				for x in (x0, x0-w):
+					painter.drawImage(QtCore.QRectF(x, 0, u1-u0, h), self.qimage, QtCore.QRectF(u0, 0, u1-u0, h))
+			return
+		for u0,u1,x0 in ((0, w-s, s), (w-s, w, 0)):
+			for v0,v1,y0 in ((0, h-s, s), (h-s, h, 0)):
+				painter.drawImage(QtCore.QRectF(x0, y0, u1-u0, v1-v0), self.qimage, QtCore.QRectF(u0, v0, u1-u0, v1-v0))
+
+	def bandShape(self): #Band area above the genome, in image coordinates
+		w,h=self.image.shape[:2]
+		path=QtGui.QPainterPath()
+		path.addPolygon(QtGui.QPolygonF([QtCore.QPointF(*p) for p in ((0, 0), (w, 0), (w-h/2, h), (-h/2, h))]))
+		return path
 
 	def setScale(self, coeff):
 		self.baseScale=coeff
+		if self.band: #pixel (i, d) of the band is the map cell (i+d, i), its centre goes to (i+d/2, -d/2) bins
+			self.setTransform(QtGui.QTransform(1, 0, 0.5, -0.5, -0.25, 0.25)*QtGui.QTransform.fromScale(coeff, coeff))
+			return
 		tr = QtGui.QTransform()
 		k=self.baseScale*(0.7071 if self.tilted else 1) 
 		tr.scale(k,k)
 		tr.rotate(-45 if self.tilted else 0)
+		tr.translate(*self.origin)
+		tr.scale(self.stride, self.stride)
 		self.setTransform(tr)
 
 	def tilt(self):
@@ -657,11 +1950,39 @@ class MyImageItem(pg.ImageItem): #allows to scale and rotate easily
 		return self.tilted
 
 
-class MyViewBox(pg.ViewBox): #fixes zooming&moving plots with locked aspect, adds independent autorange for 2 axes 
+class MyColorLegend(ColorLegendItem): #histogram and auto levels are given per processed map, not computed from the image
+
+	def __init__(self, **kwargs):
+		self.histogram=None #(histogram, levels) from hicInterface.histogram()
+		super().__init__(**kwargs)
+
+	def _updateHistogram(self):
+		if not self._histogramIsVisible or self.histogram is None or self.histogram[0] is None:
+			self.histPlotDataItem.setData([])
+			self.histPlotDataItem.clear()
+			return
+		self.histPlotDataItem.setData(*self.histogram[0])
+		histYrange=np.percentile(self.histogram[0][1], (self.histHeightPercentile, ))[0] #outliers do not flatten the rest
+		self.histViewBox.setRange(xRange=(-histYrange, 0), padding=None)
+
+	def autoScaleFromImage(self):
+		self.setLevels(self.histogram[1] if self.histogram is not None else (0.0, 1.0))
+
+
+class MyViewBox(pg.ViewBox): #fixes zooming&moving plots with locked aspect, adds independent autorange for 2 axes, Shift+drag shifts the genome
+
+	shiftDragged = pyqtSignal(float) #bp
 
 	def __init__(self):
 		super().__init__()
 
+	def mouseDragEvent(self, ev, axis=None):
+		if ev.button()==Qt.LeftButton and ev.modifiers()&Qt.ShiftModifier:
+			ev.accept()
+			self.shiftDragged.emit(self.mapToView(ev.pos()).x()-self.mapToView(ev.lastPos()).x())
+			return
+		super().mouseDragEvent(ev, axis)
+
 	def _resetTarget(self):
 		self.state['targetRange'] = [self.state['viewRange'][0][:], self.state['viewRange'][1][:]]
 
@@ -730,49 +2051,310 @@ def selectdialog(options, title):
 	return QtWidgets.QInputDialog.getItem(None, title, None, options, False)
 
 
-def makeLUT(name): #...and return certain LUT in proper format
-	redCurveList=colormaps[name]['red']
-	greenCurvelist=colormaps[name]['green']
-	blueCurvelist=colormaps[name]['blue']
-	colors=[(redCurveList[i], greenCurvelist[i], blueCurvelist[i]) for i in range(256)]
-	colorArray = np.array([np.array(color) for color in colors])
-	lookUpTab = colorArray.astype(np.uint8)
-	return lookUpTab
+def intdialog(title, label, value):
+	return QtWidgets.QInputDialog.getInt(None, title, label, value, 1)
+
 
+def errordialog(text):
+	QtWidgets.QMessageBox.warning(None, 'ProHiC', text)
 
-def OE(data): #Compute observed/expected
-	a=data
-	a=np.array([np.roll(a[i], -i) for i in range(a.shape[0])])
-	a=np.nansum(a, axis=0)
-	a=np.row_stack([a]*a.shape[0])
-	a=np.array([np.roll(a[i], i) for i in range(a.shape[0])])
-	#return(data/np.nansum(data)-a/np.nansum(a)) #Place for experiments
-	return(data/a)
 
+@functools.lru_cache(maxsize=None)
+def makeLUT(name): #...and return certain LUT in proper format, made once per colormap and read-only
+	cm=colormaps[name]
+	lookUpTab=np.array([cm['red'], cm['green'], cm['blue']]).T.astype(np.uint8)
+	lookUpTab.flags.writeable=False
+	return lookUpTab
 
-def NORM(data):
 
-	mi=(np.nanmin(data))
-	ma=(np.nanmax(data))
+def quantize(data): #uint16 display codes of a processed map (0..1): 1..65535, 0 for NaN; column-major, as images are drawn
+	codes=np.empty(data.shape, dtype=np.uint16, order='F')
+	step=max(1, 2**21//max(data.shape[1], 1)) #rows per chunk, keeps temporaries ~16 MB
+	for r0 in range(0, data.shape[0], step):
+		q=np.clip(data[r0:r0+step], 0, 1)
+		q*=65534
+		q+=1.5
+		q[np.isnan(q)]=0
+		codes[r0:r0+step]=q
+	return codes
+
+
+def histogram(data, bins=500, samples=2**20): #((bins, counts), levels) of a processed map or a sample of it, from a strided sample; normalized maps span 0..1
+	step=max(1, int(math.ceil((data.size/samples)**(1/data.ndim))))
+	sample=data[(slice(None, None, step),)*data.ndim].ravel()
+	sample=sample[np.isfinite(sample)]
+	if not len(sample):
+		return None, (0.0, 1.0)
+	counts,edges=np.histogram(sample, bins=bins, range=(0.0, 1.0))
+	return (edges[:-1], counts), (0.0, 1.0)
+
+
+@functools.lru_cache(maxsize=16)
+def levelIndex(levels): #Color index 1..255 of every display code for the levels (in 0..1 units), 0 (transparent) for NaN
+	lo,hi=levels
+	values=(np.arange(65536)-1)/65534
+	pos=np.clip((values-lo)/(hi-lo) if hi!=lo else (values>lo)*1.0, 0, 1)
+	index=(1+np.rint(pos*254)).astype(np.uint8)
+	index[0]=0
+	return index
+
+
+def colorTable(lut): #Indexed image color table: transparent, then the LUT resampled to 255 colors
+	colors=lut[np.rint(np.linspace(0, len(lut)-1, 255)).astype(int)]
+	return [QtGui.qRgba(0, 0, 0, 0)]+[QtGui.qRgb(*c) for c in colors.tolist()]
+
+
+def expected(data, check=None): #Sums over circular diagonals: e[d]=sum(data[i,(i+d)%n])
+	n=data.shape[0]
+	e=np.zeros(n)
+	step=max(1, 2**21//max(n, 1)) #rows per chunk, keeps temporaries ~32 MB
+	buf=np.empty((min(step, n), 2*n), dtype=data.dtype)
+	for r0 in range(0, n, step):
+		block=data[r0:r0+step]
+		w=buf[:block.shape[0]]
+		w[:, :n]=block
+		w[:, n:]=block
+		st=w.strides #row i of the skewed view starts at column r0+i
+		skewed=as_strided(w[:, r0:], shape=(block.shape[0], n), strides=(st[0]+st[1], st[1]))
+		e+=np.nansum(skewed, axis=0, dtype=np.float64)
+		if check is not None:
+			check()
+	return e
+
+
+def circulant(vec): #Read-only n*n view m[i,j]=vec[(j-i)%n], no n*n memory
+	n=len(vec)
+	doubled=np.concatenate((vec, vec))
+	st=doubled.strides[0]
+	return as_strided(doubled[n:], shape=(n, n), strides=(-st, st), writeable=False)
+
+
+def OE(data, exp=None, out=None): #Compute observed/expected (out=data divides in place)
+	if exp is None:
+		exp=expected(data)
+	#return(data/np.nansum(data)-circulant(exp)/np.nansum(exp)) #Place for experiments
+	return np.divide(data, circulant(exp), out=out)
+
+
+def NORM(data, mi=None, ma=None, out=None): #mi and ma may be given for parts of a map, out may be data
+
+	mi=np.nanmin(data) if mi is None else mi
+	ma=np.nanmax(data) if ma is None else ma
 	if ma!=mi:
-		return (data-mi)/(ma-mi)
+		out=np.subtract(data, mi, out=out)
+		return np.divide(out, ma-mi, out=out)
+	elif out is not None:
+		out[...]=0
+		return out
 	else:
 		return np.zeros(data.shape)
 
-def LOG(data):
+def LOG(data, mi=None, ma=None, out=None): #out may be data
 	
-	mi=np.nanmin(data)
-	ma=np.nanmax(data)
+	mi=np.nanmin(data) if mi is None else mi
+	ma=np.nanmax(data) if ma is None else ma
 	rang = ma-mi
-	shifted=data-mi+rang/10000
 	if ma!=mi:
-		return np.log10(shifted)
+		shifted=np.subtract(data, mi, out=out)
+		np.add(shifted, rang/10000, out=shifted)
+		return np.log10(shifted, out=shifted)
+	elif out is not None:
+		out[...]=0
+		return out
 	else:
 		return np.zeros(data.shape)
 
 
+def scanMatrix(data, exp=None, samples=2**20, check=None): #Value range and a strided sample of a (memory-mapped) matrix or its o/e, read by row bands
+	n=data.shape[0]
+	step=max(1, 2**22//max(n, 1))
+	stride=max(1, int(math.ceil(n/math.sqrt(samples))))
+	step=max(stride, step//stride*stride) #bands start at sampled rows
+	mi,ma=np.inf,-np.inf
+	sample=[]
+	for r0 in range(0, n, step):
+		block=np.array(data[r0:r0+step], dtype=float)
+		if exp is not None:
+			rows=np.arange(r0, r0+block.shape[0])
+			block/=exp[(np.arange(n)[None, :]-rows[:, None])%n]
+		block[~np.isfinite(block)]=np.nan
+		if not np.isnan(block).all():
+			mi,ma=min(mi, np.nanmin(block)),max(ma, np.nanmax(block))
+		sample.append(block[::stride, ::stride].ravel())
+		if check is not None:
+			check()
+	return mi, ma, np.concatenate(sample)
+
+
+def scanPixels(clr, balance=True, exp=None, chunk=2**22, samples=2**20, check=None): #Expected vector, value range and a sample of the dense map from its pixel table
+	n=clr.shape[0]
+	if isinstance(balance, np.ndarray): #computed weights
+		weights=balance
+	else:
+		weights=clr.bins()[balance if isinstance(balance, str) else 'weight'][:].values if balance else np.ones(n)
+	def chunks():
+		pixels=clr.pixels()
+		for lo in range(0, clr.info['nnz'], chunk):
+			p=pixels[lo:lo+chunk]
+			i,j=p['bin1_id'].values, p['bin2_id'].values
+			yield i, j, p['count'].values*weights[i]*weights[j]
+	return scanCells(n, clr.info['nnz'], chunks(), exp, samples, np.count_nonzero(np.isnan(weights)), check)
+
+
+def scanCells(n, nnz, chunks, exp=None, samples=2**20, masked=0, check=None): #Expected vector, value range and a sample of a symmetric map from (rows, columns, values) chunks of its upper half; cells of masked (NaN) bins are not empty
+	e=np.zeros(n)
+	mi,ma=np.inf,-np.inf
+	covered=0 #matrix cells having a pixel
+	stride=max(1, 2*nnz//samples)
+	sample=[]
+	for i,j,v in chunks:
+		good=~np.isnan(v)
+		i,j,v=i[good],j[good],v[good]
+		offdiag=i!=j
+		covered+=len(v)+np.count_nonzero(offdiag)
+		e+=np.bincount((j-i)%n, weights=v, minlength=n)
+		e+=np.bincount((i-j)[offdiag]%n, weights=v[offdiag], minlength=n)
+		if exp is not None: #o/e values differ for the two halves of the map
+			v=np.concatenate((v/exp[(j-i)%n], v[offdiag]/exp[(i-j)[offdiag]%n]))
+		if len(v):
+			mi,ma=min(mi, np.min(v)),max(ma, np.max(v))
+		sample.append(v[::stride])
+		if check is not None:
+			check()
+	sample=np.concatenate(sample) if sample else np.zeros(0)
+	cells=(n-masked)**2
+	if covered<cells: #empty cells are zeros, as many in the sample as in the map
+		mi,ma=min(mi, 0),max(ma, 0)
+		zeros=int(len(sample)*(cells-covered)/max(covered, 1))
+		step=max(1, -(-(len(sample)+zeros)//samples)) #sparse maps would give mostly zeros, the sample is kept within its size
+		sample=np.concatenate((sample[::step], np.zeros(zeros//step)))
+	return e, mi, ma, sample
+
+
+def colorize(data, lut, levels=(0, 1)): #RGB image of a processed map, NaN drawn as the lowest color
+	lo,hi=levels
+	idx=np.nan_to_num((data-lo)/(hi-lo)*(len(lut)-1), nan=0)
+	return lut[np.clip(idx, 0, len(lut)-1).astype(np.intp)]
+
+
+def tiltImage(data): #Upper half of the map turned by 45 degrees, diagonal at the bottom; the genome is circular, so n/2 off the diagonal is enough
+	n=data.shape[0]
+	c=np.arange(2*n)[None, :]
+	d=np.arange(n//2, -1, -1)[:, None] #distance from the diagonal, far at the top
+	return data[((c-d)//2)%n, ((c+d)//2)%n]
+
+
+def renderJob(job): #Open, process and write one map image, returns (path, load seconds, render seconds)
+	np.seterr(invalid='ignore')
+	t0=time.perf_counter()
+	hic=hicInterface()
+	hic.oe,hic.log=job['oe'],job['log']
+	if not hic.open(job['file'], job['res']):
+		raise ValueError('Unknown map format: '+job['file'])
+	hic.shift=50 if job['center'] else job['shift']/hic.sizebp*100
+	t1=time.perf_counter()
+	stride=max(1, math.ceil(hic.size/job['maxSize']))
+	if hic.lazy():
+		data=hic.block(0, hic.size, 0, hic.size, stride)
+	else:
+		data=hic.product()[::stride, ::stride]
+	if job['tilt']:
+		data=tiltImage(data)
+	rgb=np.ascontiguousarray(colorize(data, makeLUT(job['cmap']), job['levels']))
+	path=os.path.join(job['outdir'], '{}_{}{}{}{}.png'.format(job['stem'], hic.res, '_oe' if hic.oe else '',
+		'_log' if hic.log else '', '_tilt' if job['tilt'] else ''))
+	image=QtGui.QImage(rgb.data, rgb.shape[1], rgb.shape[0], 3*rgb.shape[1], QtGui.QImage.Format_RGB888)
+	if not image.save(path):
+		raise OSError('Cannot write '+path)
+	return path, t1-t0, time.perf_counter()-t1
+
+
+def outputStems(files): #Image name of every map file: its name without extension, clashing ones with their folders below the common one, e.g. sampleA_map
+	paths=list(dict.fromkeys(os.path.abspath(f) for f in files))
+	groups={}
+	for p in paths:
+		groups.setdefault(os.path.splitext(basename(p))[0], []).append(p)
+	stems={}
+	for stem,group in groups.items():
+		if len(group)==1:
+			stems[group[0]]=stem
+			continue
+		rels=[os.path.relpath(p, os.path.commonpath(group)) for p in group]
+		names=[os.path.splitext(r)[0] for r in rels]
+		if len(set(names))<len(names): #same name in one folder, e.g. map.cool and map.npy
+			names=rels
+		stems.update((p, n.replace(os.sep, '_')) for p,n in zip(group, names))
+	return {f:stems[os.path.abspath(f)] for f in files}
+
+
+def render(argv): #"prohic render" command writes map images without GUI, in parallel processes
+	import argparse
+	from concurrent.futures import ProcessPoolExecutor, as_completed
+	parser=argparse.ArgumentParser(prog='prohic render', description='Write PNG images of HiC maps without GUI')
+	parser.add_argument('maps', nargs='+', help='.mcool, .cool, .npy, .npz or .np files')
+	parser.add_argument('-r', '--res', nargs='+', default=['5000'], help='resolutions of .mcool files (nearest available is used), or "all"')
+	parser.add_argument('--bin-size', dest='binSize', type=int, default=1, help='bin size of .npy, .npz and .np matrices, bp')
+	parser.add_argument('--oe', action='store_true', help='observed/expected map')
+	parser.add_argument('--no-log', dest='log', action='store_false', help='linear color scale')
+	parser.add_argument('--shift', type=int, default=0, help='genome shift, bp')
+	parser.add_argument('--center', action='store_true', help='shift the origin to the center')
+	parser.add_argument('--tilt', action='store_true', help='tilted view of the upper triangle')
+	parser.add_argument('--cmap', default='magma', choices=sorted(colormaps), help='color palette')
+	parser.add_argument('--levels', type=float, nargs=2, default=(0, 1), metavar=('LOW', 'HIGH'), help='color scale range of the processed map (0..1)')
+	parser.add_argument('--max-size', dest='maxSize', type=int, default=8192, help='bigger maps are subsampled to this size, pixels')
+	parser.add_argument('-o', '--outdir', default='.', help='output folder')
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='parallel processes')
+	args=parser.parse_args(argv)
+
+	jobs=[]
+	failed=0
+	stems=outputStems(args.maps)
+	for file in dict.fromkeys(args.maps):
+		if file.endswith('.mcool'):
+			try:
+				levels=[int(i) for i in hicInterface().listResolutions(file)]
+			except Exception as e:
+				failed+=1
+				print('{}: {}'.format(basename(file), e), file=sys.stderr)
+				continue
+			resolutions=levels if 'all' in args.res else [min(levels, key=lambda i: abs(i-int(r))) for r in args.res if r!='all'] #nearest levels, once each
+		elif file.endswith(('.np', '.npy', '.npz')):
+			resolutions=[args.binSize]
+		else:
+			resolutions=[None]
+		for res in dict.fromkeys(resolutions):
+			jobs.append(dict(vars(args), file=file, res=res, stem=stems[file]))
+	os.makedirs(args.outdir, exist_ok=True)
+
+	start=time.perf_counter()
+	written=0
+	with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+		futures={pool.submit(renderJob, job):job for job in jobs}
+		for f in as_completed(futures):
+			job=futures[f]
+			try:
+				path,load,draw=f.result()
+				written+=1
+				print('{}  load {:.2f} s  render {:.2f} s'.format(path, load, draw))
+			except Exception as e:
+				failed+=1
+				print('{} {}: {}'.format(basename(job['file']), job['res'] or '', e), file=sys.stderr)
+	total=time.perf_counter()-start
+	print('{} images in {:.2f} s, {:.2f} images/s'.format(written, total, written/total))
+	return 1 if failed else 0
+
+
 def main():
 
+	if len(sys.argv) > 1 and sys.argv[1] == 'render':
+		sys.exit(render(sys.argv[2:]))
+
+	if '--profile' in sys.argv: # "prohic --profile [trace.json]" times actions, as does PROHIC_PROFILE=trace.json
+		given=sys.argv[sys.argv.index('--profile')+1:][:1]
+		profiler.enable(given[0] if given and not given[0].startswith('-') else 'prohic-trace.json')
+	elif os.environ.get('PROHIC_PROFILE'):
+		profiler.enable(os.environ['PROHIC_PROFILE'])
+
 	if len(sys.argv) > 1: # "prohic shortcut" command makes a desktop shortcut
 		if sys.argv[1] == 'shortcut':
 			print("Making desktop shortcut...")
@@ -785,7 +2367,9 @@ def main():
 
 	global monoFont
 	global dpr
-	
+
+	marks=[('start', startupTime), ('imports', time.perf_counter())] # "prohic --startup-profile" prints startup stages and quits
+
 	np.seterr(invalid='ignore')
 	pg.setConfigOption('foreground', '#AAA') #make fg color lighter
 
@@ -793,6 +2377,7 @@ def main():
 	font=app.font()
 	font.setPointSize(font.pointSize()+1)
 	app.setFont(font)
+	marks.append(('QApplication', time.perf_counter()))
 
 	#Not the best idea, but will work on most OS
 	if sys.platform=='win32':
@@ -804,6 +2389,22 @@ def main():
 
 	window = BrowserWindow() #Make main window
 	dpr=window.devicePixelRatio() #Global var to scale interface correctly
+	marks.append(('window', time.perf_counter()))
+	if '--startup-profile' in sys.argv:
+		QtCore.QTimer.singleShot(0, lambda: startupReport(app, marks))
 	sys.exit(app.exec_()) #Main cycle
 
-main() # if started directly as "python prohic.py" or similarly
+
+def startupReport(app, marks): #Print time of the startup stages, then of the imports deferred to the first map
+	app.processEvents() #first paint
+	marks.append(('first paint', time.perf_counter()))
+	for (_,t0),(name,t1) in zip(marks, marks[1:]):
+		print('{:<16}{:8.1f} ms'.format(name, (t1-t0)*1000))
+	print('{:<16}{:8.1f} ms'.format('total', (marks[-1][1]-marks[0][1])*1000))
+	t0=time.perf_counter()
+	import cooler
+	print('{:<16}{:8.1f} ms (with the first map)'.format('cooler import', (time.perf_counter()-t0)*1000))
+	app.quit()
+
+if __name__=='__main__': # if started directly as "python prohic.py" or similarly
+	main()
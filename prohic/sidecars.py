@@ -0,0 +1,45 @@
+import hashlib
+import os
+import threading
+import zipfile
+
+import numpy as np
+
+
+def cacheDir(): #Per-user cache directory, used when the directory of a file is not writable
+	base=os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'prohic')
+
+
+def sidecars(fname): #Candidate sidecar paths, next to the file first
+	fname=os.path.abspath(fname)
+	digest=hashlib.sha1(fname.encode()).hexdigest()[:16]
+	return [fname+'.prohic.npz', os.path.join(cacheDir(), 'tracks', digest+'.npz')]
+
+
+def tmpName(path): #Unique per process and thread, so that writers of the same file do not clash
+	return '{}.{}.{}.tmp.npz'.format(path, os.getpid(), threading.get_ident())
+
+
+def loadSidecar(fname, key): #Path of the sidecar of fname stored with key (size, mtime, version...), None if there is no such one
+	for path in sidecars(fname):
+		try:
+			with np.load(path, allow_pickle=False) as f:
+				if np.array_equal(f['key'], key):
+					return path
+		except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+			pass
+	return None
+
+
+def saveSidecar(fname, key, **arrays): #Store arrays with key in the first writable sidecar path, returns it or None
+	for path in sidecars(fname):
+		try:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			tmp=tmpName(path)
+			np.savez(tmp, key=key, **arrays)
+			os.replace(tmp, path)
+			return path
+		except OSError:
+			pass
+	return None
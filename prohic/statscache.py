@@ -0,0 +1,118 @@
+import hashlib
+import os
+import threading
+import zipfile
+
+import numpy as np
+
+try:
+	from .sidecars import cacheDir, tmpName
+except:
+	from sidecars import cacheDir, tmpName
+
+cacheVersion=2
+
+
+class StatsStore(): #Statistics derived from maps kept between sessions as .npz files per file state; least recently used are removed beyond the size budget
+
+	def __init__(self, directory=None, budget=None):
+		self.directory=directory or os.path.join(cacheDir(), 'stats')
+		self.budget=int(os.environ.get('PROHIC_STATS_CACHE_MB', 256))*2**20 if budget is None else budget #0 - nothing is stored
+		self.lock=threading.Lock()
+
+	def path(self, kind, key): #File of a value, None if the map files named in key[0] cannot be found
+		names=key[0] if isinstance(key[0], tuple) else (key[0],)
+		state=[]
+		for name in names:
+			if isinstance(name, str) and os.path.isfile(name): #not e.g. the mode of a comparison
+				st=os.stat(name)
+				state.append((os.path.abspath(name), st.st_size, st.st_mtime_ns))
+		if not state:
+			return None
+		digest=hashlib.sha1(repr((cacheVersion, kind, state, names, key[1:])).encode()).hexdigest()
+		return os.path.join(self.directory, kind+'-'+digest+'.npz')
+
+	def load(self, kind, key):
+		if not self.budget:
+			return None
+		try:
+			path=self.path(kind, key)
+			if path is None:
+				return None
+			with np.load(path, allow_pickle=False) as f:
+				value=unpack(f, 'v')
+			os.utime(path) #recently used
+			return value
+		except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+			return None
+
+	def save(self, kind, key, value):
+		if not self.budget:
+			return
+		try:
+			path=self.path(kind, key)
+			if path is None:
+				return
+			os.makedirs(self.directory, exist_ok=True)
+			tmp=tmpName(path)
+			arrays={}
+			pack(value, 'v', arrays)
+			np.savez(tmp, **arrays)
+			os.replace(tmp, path)
+			self.evict()
+		except OSError:
+			pass
+
+	def evict(self): #Remove least recently used files beyond the budget
+		with self.lock:
+			files=[]
+			for entry in os.scandir(self.directory):
+				if entry.name.endswith('.npz') and not entry.name.endswith('.tmp.npz'):
+					st=entry.stat()
+					files.append((st.st_mtime, st.st_size, entry.path))
+			total=sum(size for mtime,size,path in files)
+			for mtime,size,path in sorted(files):
+				if total<=self.budget:
+					break
+				try:
+					os.remove(path)
+					total-=size
+				except OSError:
+					pass
+
+
+class StoredDict(dict): #Dict of map statistics (arrays, numbers and tuples of them) per key with the map file first, backed by a StatsStore
+
+	def __init__(self, store, kind):
+		super().__init__()
+		self.store=store
+		self.kind=kind
+
+	def __contains__(self, key):
+		if super().__contains__(key):
+			return True
+		value=self.store.load(self.kind, key)
+		if value is None:
+			return False
+		super().__setitem__(key, value)
+		return True
+
+	def __setitem__(self, key, value):
+		super().__setitem__(key, value)
+		self.store.save(self.kind, key, value)
+
+
+def pack(value, name, out): #Flatten nested tuples into named arrays
+	if isinstance(value, (tuple, list)):
+		out[name+'#']=np.array(len(value))
+		for i,v in enumerate(value):
+			pack(v, '{}.{}'.format(name, i), out)
+	else:
+		out[name]=np.asarray(value)
+
+
+def unpack(f, name):
+	if name+'#' in f.files:
+		return tuple(unpack(f, '{}.{}'.format(name, i)) for i in range(int(f[name+'#'])))
+	value=f[name]
+	return value[()] if value.ndim==0 else value
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+import csv
+import gzip
+import os
+import struct
+import zlib
+
+import numpy as np
+
+try:
+	from .sidecars import loadSidecar, saveSidecar
+except:
+	from sidecars import loadSidecar, saveSidecar
+
+cacheVersion=1
+chunkRows=1<<20
+
+formats={ #format: (used columns, names of the resulting arrays)
+	'bed':((1,2,3), ('starts','ends','names')),
+	'gff':((2,3,4,6,8), ('types','starts','ends','strands','attributes')),
+	'bedgraph':((1,2,3), ('starts','ends','values'))}
+
+dtypes={'starts':np.int64, 'ends':np.int64, 'values':np.float64}
+
+
+def trackFormat(fname): #Track format by file extension, .gz is looked through
+	name=fname[:-3] if fname.endswith('.gz') else fname
+	if name[-4:]=='.bed':
+		return 'bed'
+	if name[-4:] in ('.gff', 'gff2', 'gff3'):
+		return 'gff'
+	if name[-9:]=='.bedgraph':
+		return 'bedgraph'
+	return None
+
+
+def readTrack(fname): #Return (format, dict of column arrays), from the sidecar if it is up to date
+	fmt=trackFormat(fname)
+	if fmt is None:
+		raise ValueError('Unknown track format: '+os.path.basename(fname))
+	st=os.stat(fname)
+	key=np.array([cacheVersion, st.st_size, st.st_mtime_ns], dtype=np.int64)
+	path=loadSidecar(fname, key)
+	if path is not None:
+		with np.load(path, allow_pickle=False) as f:
+			return fmt, {k:f[k] for k in formats[fmt][1]}
+	data=parseTrack(fname, fmt)
+	saveSidecar(fname, key, **data)
+	return fmt, data
+
+
+def headerLines(fname): #Number of leading track/browser/comment lines
+	n=0
+	with gzip.open(fname, 'rt') if fname.endswith('.gz') else open(fname) as f:
+		for line in f:
+			if not line.startswith(('track', 'browser', '#')) and line.strip():
+				break
+			n+=1
+	return n
+
+
+def parseTrack(fname, fmt): #Read only the used columns, in chunks, .gz decompressed on the fly
+	import pandas as pd
+	usecols,names=formats[fmt]
+	reader=pd.read_csv(fname, sep='\t', header=None, usecols=usecols,
+		dtype={col:str for col,k in zip(usecols, names) if k not in dtypes},
+		skiprows=headerLines(fname), comment='#' if fmt=='gff' else None,
+		quoting=csv.QUOTE_NONE, float_precision='round_trip', chunksize=chunkRows, compression='infer')
+	chunks={k:[] for k in names}
+	for chunk in reader:
+		chunk=chunk.dropna() #blank and FASTA lines
+		for col,k in zip(usecols, names):
+			chunks[k].append(chunk[col].to_numpy(dtype=dtypes.get(k, str)))
+	return {k:np.concatenate(v) if v else np.zeros(0, dtype=dtypes.get(k, str)) for k,v in chunks.items()}
+
+
+def isTabix(fname): #bgzipped track with a tabix index next to it
+	return fname.endswith('.gz') and os.path.exists(fname+'.tbi')
+
+
+class TabixTrack(): #Region queries on a bgzipped, tabix-indexed track, decompressed blocks are kept in a small LRU
+
+	def __init__(self, fname, maxBlocks=256):
+		self.fname=fname
+		self.fmt=trackFormat(fname)
+		self.blocks=OrderedDict()
+		self.maxBlocks=maxBlocks
+		self.file=open(fname, 'rb')
+		with gzip.open(fname+'.tbi', 'rb') as f:
+			index=f.read()
+		magic,nRef,self.preset,self.colSeq,self.colBeg,self.colEnd,meta,self.skip,nameLen=struct.unpack_from('<4s8i', index)
+		if magic!=b'TBI\x01':
+			raise ValueError('Not a tabix index: '+os.path.basename(fname)+'.tbi')
+		self.meta=chr(meta)
+		self.names=index[36:36+nameLen].split(b'\0')[:nRef]
+		pos=36+nameLen
+		self.refs=[]
+		for ref in range(nRef): #{bin: chunks}, linear index
+			bins={}
+			nBin,=struct.unpack_from('<i', index, pos)
+			pos+=4
+			for b in range(nBin):
+				binId,nChunk=struct.unpack_from('<Ii', index, pos)
+				bins[binId]=np.frombuffer(index, dtype='<u8', count=2*nChunk, offset=pos+8).reshape(-1, 2)
+				pos+=8+16*nChunk
+			nIntv,=struct.unpack_from('<i', index, pos)
+			self.refs.append((bins, np.frombuffer(index, dtype='<u8', count=nIntv, offset=pos+4)))
+			pos+=4+8*nIntv
+
+	def block(self, offset): #Decompressed BGZF block at a file offset and the offset of the next one
+		if offset in self.blocks:
+			self.blocks.move_to_end(offset)
+			return self.blocks[offset]
+		self.file.seek(offset)
+		header=self.file.read(12)
+		if len(header)<12:
+			return b'', offset
+		extra=self.file.read(struct.unpack_from('<H', header, 10)[0])
+		size=None
+		i=0
+		while i<len(extra): #BC subfield holds the block size
+			sub,length=extra[i:i+2],struct.unpack_from('<H', extra, i+2)[0]
+			if sub==b'BC':
+				size=struct.unpack_from('<H', extra, i+4)[0]+1
+			i+=4+length
+		data=zlib.decompress(self.file.read(size-12-len(extra)), -15)
+		self.blocks[offset]=(data, offset+size)
+		if len(self.blocks)>self.maxBlocks:
+			self.blocks.popitem(last=False)
+		return self.blocks[offset]
+
+	def read(self, start, end): #Text between two virtual offsets
+		out=[]
+		offset,within=start>>16,start&0xffff
+		while offset<(end>>16) or (offset==(end>>16) and within<(end&0xffff)):
+			data,following=self.block(offset)
+			if not data and following==offset:
+				break
+			stop=end&0xffff if offset==(end>>16) else len(data)
+			out.append(data[within:stop])
+			offset,within=following,0
+		return b''.join(out)
+
+	@staticmethod
+	def bins(beg, end): #UCSC bins that may hold intervals overlapping [beg, end)
+		end-=1
+		out=[0]
+		for first,shift in ((1, 26), (9, 23), (73, 20), (585, 17), (4681, 14)):
+			out.extend(range(first+(beg>>shift), first+(end>>shift)+1))
+		return out
+
+	def query(self, beg, end): #Column arrays of the records overlapping [beg, end) on all sequences
+		beg,end=max(0, int(beg)-1),int(end)+1 #GFF is 1-based, one extra position covers both conventions
+		lines=[]
+		for bins,linear in self.refs:
+			chunks=[bins[b] for b in self.bins(beg, end) if b in bins]
+			if not chunks:
+				continue
+			chunks=np.concatenate(chunks)
+			minOffset=linear[min(beg>>14, len(linear)-1)] if len(linear) else 0
+			chunks=chunks[chunks[:,1]>minOffset]
+			chunks=chunks[np.argsort(chunks[:,0])]
+			merged=[]
+			for a,b in chunks.tolist():
+				if merged and a<=merged[-1][1]:
+					merged[-1][1]=max(merged[-1][1], b)
+				else:
+					merged.append([max(a, minOffset), b])
+			for a,b in merged:
+				lines.extend(self.read(a, b).decode().splitlines())
+		return self.parse(lines, beg, end)
+
+	def parse(self, lines, beg, end): #Column arrays of the records from text lines overlapping [beg, end)
+		usecols,names=formats[self.fmt]
+		rows=[l.split('\t') for l in lines if l and not l.startswith((self.meta, 'track', 'browser'))]
+		rows=[r for r in rows if len(r)>usecols[-1]]
+		cols={k:np.array([r[c] for r in rows], dtype=dtypes.get(k, str)) for c,k in zip(usecols, names)}
+		keep=(cols['starts']<end)&(cols['ends']>beg)
+		order=np.argsort(cols['starts'][keep], kind='stable')
+		return {k:v[keep][order] for k,v in cols.items()}
+
+	def close(self):
+		self.file.close()
+		self.blocks.clear()
+
+	def extent(self): #Approximate length of the longest sequence, from the 16 kb linear index
+		return max((len(linear)<<14 for bins,linear in self.refs), default=0)
@@ -0,0 +1,35 @@
+#Sparse maps drawn by parts should look as the same map loaded as a whole, run with pytest
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+import pytest
+
+from prohic.prohic import hicInterface
+
+testdata=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata')
+
+np.seterr(invalid='ignore', divide='ignore')
+
+
+def openMap(file, res, oe, log, lazyBins=8192):
+	hic=hicInterface()
+	hic.expectedCache,hic.statsCache,hic.histCache,hic.resolutionCache={},{},{},{} #not the ones kept on disk
+	hic.lazyBins=lazyBins
+	hic.oe,hic.log=oe,log
+	hic.open(os.path.join(testdata, file), res)
+	return hic
+
+
+@pytest.mark.parametrize('oe', [False, True])
+@pytest.mark.parametrize('log', [False, True])
+def test_sparseBlock(oe, log): #Haloferax at 2500 bp has bins without balancing weights
+	dense=openMap('Haloferax/Haloferax.mcool', 2500, oe, log)
+	sparse=openMap('Haloferax/Haloferax.mcool', 2500, oe, log, lazyBins=10)
+	assert sparse.sparse is not None
+	n=sparse.size
+	expected=dense.product()
+	block=sparse.block(0, n, 0, n)
+	assert np.array_equal(np.isnan(block), np.isnan(expected))
+	assert np.allclose(block, expected, equal_nan=True)
@@ -0,0 +1,108 @@
+#Region queries on bgzipped, tabix-indexed tracks should find what filtering the whole parsed track finds, run with pytest
+import gzip
+import os
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from prohic.tracks import TabixTrack, parseTrack, trackFormat
+
+testdata=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata')
+
+
+def bgzip(path, text, blockSize=4096): #BGZF file of text cut into blocks of blockSize bytes (also within lines) and the EOF block, returns file offsets of the blocks
+	offsets=[]
+	with open(path, 'wb') as f:
+		for i in list(range(0, len(text), blockSize))+[len(text)]:
+			data=text[i:i+blockSize] if i<len(text) else b''
+			offsets.append(f.tell())
+			c=zlib.compressobj(6, zlib.DEFLATED, -15)
+			deflated=c.compress(data)+c.flush()
+			f.write(b'\x1f\x8b\x08\x04'+b'\0'*4+b'\0\xff'+struct.pack('<H2sHH', 6, b'BC', 2, len(deflated)+25)) #BSIZE is the block size-1
+			f.write(deflated+struct.pack('<II', zlib.crc32(data), len(data)))
+	return offsets
+
+
+def reg2bin(beg, end): #Smallest UCSC bin holding [beg, end)
+	end-=1
+	for first,shift in ((4681, 14), (585, 17), (73, 20), (9, 23), (1, 26)):
+		if beg>>shift==end>>shift:
+			return first+(beg>>shift)
+	return 0
+
+
+def tabix(path, lines, fmt, blockSize=4096): #Write lines (sorted by sequence and start) bgzipped, with a .tbi index as tabix makes it
+	text=''.join(lines).encode()
+	offsets=bgzip(path, text, blockSize)
+	virtual=lambda pos: offsets[pos//blockSize]<<16|pos%blockSize
+	colSeq,colBeg,colEnd,preset=(1, 4, 5, 0) if fmt=='gff' else (1, 2, 3, 0x10000) #bed-like tracks are 0-based
+	names,refs,pos={},[],0
+	for line in lines:
+		start,pos=pos,pos+len(line.encode())
+		if line.startswith(('#', 'track', 'browser')):
+			continue
+		cols=line.split('\t')
+		beg,end=int(cols[colBeg-1])-(1 if fmt=='gff' else 0),int(cols[colEnd-1])
+		if cols[0] not in names:
+			names[cols[0]]=len(refs)
+			refs.append(({}, {}))
+		bins,linear=refs[names[cols[0]]]
+		chunk=[virtual(start), virtual(pos)]
+		chunks=bins.setdefault(reg2bin(beg, end), [])
+		if chunks and chunks[-1][1]==chunk[0]: #records next to each other in one chunk
+			chunks[-1][1]=chunk[1]
+		else:
+			chunks.append(chunk)
+		for w in range(beg>>14, ((end-1)>>14)+1):
+			linear.setdefault(w, chunk[0])
+	nameBytes=b''.join(n.encode()+b'\0' for n in names)
+	out=[struct.pack('<4s8i', b'TBI\x01', len(refs), preset, colSeq, colBeg, colEnd, ord('#'), 0, len(nameBytes)), nameBytes]
+	for bins,linear in refs:
+		out.append(struct.pack('<i', len(bins)))
+		for b,chunks in bins.items():
+			out.append(struct.pack('<Ii', b, len(chunks))+np.array(chunks, dtype='<u8').tobytes())
+		ioff,last=[],0
+		for w in range(max(linear)+1 if linear else 0):
+			last=linear.get(w, last)
+			ioff.append(last)
+		out.append(struct.pack('<i', len(ioff))+np.array(ioff, dtype='<u8').tobytes())
+	with gzip.open(path+'.tbi', 'wb') as f:
+		f.write(b''.join(out))
+
+
+def sortedLines(fname, copies=1): #Records sorted by sequence and start as tabix needs them, copies on more sequences
+	fmt=trackFormat(fname)
+	with open(fname) as f:
+		lines=[l if l.endswith('\n') else l+'\n' for l in f if l.strip()]
+	header=[l for l in lines if l.startswith(('#', 'track', 'browser'))]
+	records=[l for l in lines if l not in header]
+	col=3 if fmt=='gff' else 1
+	out=[]
+	for k in range(copies):
+		seq=[l if k==0 else 'seq{}\t'.format(k)+l.split('\t', 1)[1] for l in records]
+		out+=sorted(seq, key=lambda l: int(l.split('\t')[col]))
+	return header+out
+
+
+@pytest.mark.parametrize('track,copies', [('Haloferax/Haloferax_RNA-seq.bedgraph', 1), ('Caulobacter/Caulobacter_tRNA.gff3', 2), ('Caulobacter/Caulobacter_ori-ter.bed', 1)])
+def test_tabixQuery(tmp_path, track, copies):
+	fmt=trackFormat(track)
+	lines=sortedLines(os.path.join(testdata, track), copies)
+	plain=str(tmp_path/os.path.basename(track))
+	with open(plain, 'w') as f:
+		f.writelines(lines)
+	tabix(plain+'.gz', lines, fmt, blockSize=1000) #small blocks, so that queries span several
+	whole=parseTrack(plain, fmt)
+	source=TabixTrack(plain+'.gz')
+	extent=int(whole['ends'].max())
+	rng=np.random.default_rng(0)
+	queries=[(0, extent+1)]+[tuple(sorted(rng.integers(0, extent+1, 2))) for i in range(200)]+[(b, b+rng.integers(1, 5000)) for b in rng.integers(0, extent, 100)]
+	for beg,end in queries:
+		found=source.query(beg, end)
+		lo,hi=max(0, int(beg)-1),int(end)+1 #as query widens the region
+		keep=(whole['starts']<hi)&(whole['ends']>lo)
+		order=np.argsort(whole['starts'][keep], kind='stable')
+		for k in whole:
+			assert [str(i) for i in found[k]]==[str(i) for i in whole[k][keep][order]], (beg, end, k)